@@ -1,23 +1,283 @@
-"""Sonarr and Radarr API clients with a shared HTTP base."""
+"""Sonarr, Radarr and Plex API clients with a shared HTTP base."""
 from __future__ import annotations
 
+import codecs
+import json
 import logging
+import posixpath
+import random
+import re
+import threading
 import time
-from typing import Any, Optional
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
 
 log = logging.getLogger(__name__)
 
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_MAX_BACKOFF = 60.0
+_STREAM_CHUNK = 64 * 1024
+
+_HTTP_REQUESTS = metrics.Counter(
+    "plex_linker_http_requests_total",
+    "Sonarr/Radarr/Plex API requests by endpoint and status (status 'error' for connection failures)",
+    ("service", "method", "endpoint", "status"),
+)
+_HTTP_LATENCY = metrics.Histogram(
+    "plex_linker_http_request_duration_seconds",
+    "Sonarr/Radarr/Plex API request latency, excluding rate-limit waits",
+    ("service", "method", "endpoint"),
+)
+_HTTP_THROTTLE = metrics.Counter(
+    "plex_linker_http_throttle_seconds_total",
+    "Seconds spent waiting on the per-host rate limit",
+    ("service",),
+)
+_HTTP_BYTES = metrics.Counter(
+    "plex_linker_http_response_bytes_total",
+    "Decoded Sonarr/Radarr/Plex response body bytes",
+    ("service",),
+)
+_HTTP_RETRY_SLEEP = metrics.Counter(
+    "plex_linker_http_retry_sleep_seconds_total",
+    "Seconds spent in retry backoff after 429/5xx responses or connection errors",
+    ("service",),
+)
+
+
+@dataclass(frozen=True)
+class HttpPolicy:
+    """Rate limit, retry and connection-pool settings shared by all API clients."""
+
+    rate: float = 10.0
+    burst: int = 10
+    max_retries: int = 4
+    backoff: float = 0.5
+    pool_size: int = 10
+    timeout: float = 30.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` requests per second with bursts of up to ``burst``."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping as needed. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif self.rate <= 0:
+                    return waited
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def block_for(self, seconds: float) -> None:
+        """Hold back every caller of this bucket, e.g. after a 429 with ``Retry-After``."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket_for(host: str, policy: HttpPolicy) -> TokenBucket:
+    """One bucket per host, shared by every client that talks to it."""
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = _buckets[host] = TokenBucket(policy.rate, policy.burst)
+        else:
+            bucket.rate, bucket.burst = policy.rate, max(1, policy.burst)
+        return bucket
+
+
+def _retry_after(resp: requests.Response) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Yield the elements of a top-level JSON array as its bytes arrive.
+
+    Only the unparsed tail of the document and the element being decoded are held in memory, so
+    callers that keep a projection of each element never hold the whole payload.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf, pos, eof = "", 0, False
+    state = "start"  # start -> first -> (value -> after -> item)* -> end
+
+    def more() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = next(chunks, None)
+        eof = chunk is None
+        buf = buf[pos:] + utf8.decode(chunk or b"", final=eof)
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+        if pos == len(buf):
+            if not more():
+                raise ValueError("Truncated JSON array")
+            continue
+        ch = buf[pos]
+        if state == "start":
+            if ch != "[":
+                raise ValueError("Expected a JSON array")
+            pos, state = pos + 1, "first"
+        elif ch == "]" and state in ("first", "after"):
+            return
+        elif state == "after":
+            if ch != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {ch!r}")
+            pos, state = pos + 1, "item"
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not more():
+                    raise
+                continue
+            # A number cut off by the end of the buffer ("12", "2.", "3e") continues in the next chunk.
+            if isinstance(value, (int, float)) and not eof and buf[end : end + 1] in ("", ".", "e", "E"):
+                more()
+                continue
+            yield value
+            pos, state = end, "after"
+
+
+def _endpoint(path: str) -> str:
+    """Path with numeric IDs replaced, so ``episode/123`` and ``episode/456`` share a label."""
+    return re.sub(r"/\d+(?=/|$)", "/{id}", "/" + path.strip("/"))
+
 
 class _ArrClient:
-    """Base class for *arr API clients."""
+    """Base class for *arr (and Plex) API clients.
 
-    def __init__(self, base_url: str, api_key: str, *, throttle: float = 0.5) -> None:
+    ``calls`` and ``bytes_received`` count every HTTP response (including retried ones) made
+    through this client, for the per-run history.
+    """
+
+    service = ""
+    auth_header = "X-Api-Key"
+
+    def __init__(self, base_url: str, api_key: str, *, policy: HttpPolicy = HttpPolicy()) -> None:
         self.base_url = base_url.rstrip("/")
-        self._throttle = throttle
+        self._policy = policy
+        self._bucket = _bucket_for(urlsplit(self.base_url).netloc, policy)
         self._session = requests.Session()
-        self._session.headers["X-Api-Key"] = api_key
+        adapter = HTTPAdapter(pool_connections=policy.pool_size, pool_maxsize=policy.pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers[self.auth_header] = api_key
+        self._session.headers["Accept-Encoding"] = "gzip"
+        self.calls = 0
+        self.bytes_received = 0
+        self._stats_lock = threading.Lock()
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(_MAX_BACKOFF, self._policy.backoff * 2**attempt))
+
+    def _count_bytes(self, size: int) -> None:
+        _HTTP_BYTES.inc(size, service=self.service)
+        with self._stats_lock:
+            self.bytes_received += size
+
+    def _send(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: Optional[dict] = None,
+        json: Optional[dict] = None,
+        stream: bool = False,
+    ) -> requests.Response:
+        """Send a request with rate limiting and retries; return the successful response.
+
+        With ``stream`` the body is left unread for the caller, who must close the response.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        endpoint = _endpoint(path)
+        attempt = 0
+        while True:
+            waited = self._bucket.acquire()
+            if waited:
+                _HTTP_THROTTLE.inc(waited, service=self.service)
+            start = time.perf_counter()
+            try:
+                resp = self._session.request(
+                    method, url, params=params, json=json, timeout=self._policy.timeout, stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                _HTTP_REQUESTS.inc(service=self.service, method=method, endpoint=endpoint, status="error")
+                if attempt >= self._policy.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                log.warning("%s %s failed (%s), retrying in %.1fs", method, url, exc, delay)
+            else:
+                _HTTP_LATENCY.observe(
+                    time.perf_counter() - start, service=self.service, method=method, endpoint=endpoint
+                )
+                _HTTP_REQUESTS.inc(
+                    service=self.service, method=method, endpoint=endpoint, status=str(resp.status_code)
+                )
+                with self._stats_lock:
+                    self.calls += 1
+                done = resp.status_code not in _RETRY_STATUSES or attempt >= self._policy.max_retries
+                if done and stream and resp.ok:
+                    return resp
+                self._count_bytes(len(resp.content))
+                if done:
+                    resp.raise_for_status()
+                    return resp
+                retry_after = _retry_after(resp)
+                delay = self._backoff(attempt) if retry_after is None else min(retry_after, _MAX_BACKOFF)
+                if retry_after is not None:
+                    self._bucket.block_for(delay)
+                log.warning("%s %s returned %d, retrying in %.1fs", method, url, resp.status_code, delay)
+            _HTTP_RETRY_SLEEP.inc(delay, service=self.service)
+            time.sleep(delay)
+            attempt += 1
 
     def _request(
         self,
@@ -27,21 +287,57 @@ class _ArrClient:
         params: Optional[dict] = None,
         json: Optional[dict] = None,
     ) -> Any:
-        url = f"{self.base_url}/{path.lstrip('/')}"
-        time.sleep(self._throttle)
-        resp = self._session.request(method, url, params=params, json=json, timeout=30)
-        resp.raise_for_status()
-        return resp.json()
+        return self._send(method, path, params=params, json=json).json()
+
+    def _stream_list(self, path: str) -> Iterator[dict]:
+        """GET a JSON array endpoint and yield its entries one at a time as they are parsed."""
+        resp = self._send("GET", path, stream=True)
+        size = 0
 
+        def chunks() -> Iterator[bytes]:
+            nonlocal size
+            for chunk in resp.iter_content(chunk_size=_STREAM_CHUNK):
+                size += len(chunk)
+                yield chunk
 
-class SonarrClient(_ArrClient):
-    def __init__(self, base_url: str, api_key: str, *, root_path_prefix: str = "/") -> None:
-        super().__init__(base_url, api_key)
+        try:
+            yield from _iter_json_array(chunks())
+        finally:
+            resp.close()
+            self._count_bytes(size)
+
+
+class _LibraryClient(_ArrClient):
+    """A Sonarr or Radarr instance: ``instance`` is its configured number (``SONARR_<N>_*``)."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        *,
+        instance: int = 0,
+        root_path_prefix: str = "/",
+        policy: HttpPolicy = HttpPolicy(),
+    ) -> None:
+        super().__init__(base_url, api_key, policy=policy)
+        self.instance = instance
         self.root_path_prefix = root_path_prefix
 
+    def media_path(self, path: str) -> str:
+        """A library path as the instance reports it, with its root path prefix stripped."""
+        return path.replace(self.root_path_prefix, "", 1)
+
+
+class SonarrClient(_LibraryClient):
+    service = "sonarr"
+
     def get_series(self) -> list[dict]:
         return self._request("GET", "series")
 
+    def iter_series(self) -> Iterator[dict]:
+        """Stream the series list entry by entry instead of loading the whole document."""
+        return self._stream_list("series")
+
     def lookup_series(self, title: str) -> Optional[dict]:
         data = self._request("GET", "series/lookup", params={"term": title})
         if isinstance(data, list) and data:
@@ -68,16 +364,76 @@ class SonarrClient(_ArrClient):
     def rescan_series(self, series_id: int) -> Any:
         return self._request("POST", "command", json={"name": "RescanSeries", "seriesId": series_id})
 
-    def refresh_series(self, series_id: int) -> Any:
-        return self._request("POST", "command", json={"name": "RefreshSeries", "seriesId": series_id})
 
+class RadarrClient(_LibraryClient):
+    service = "radarr"
 
-class RadarrClient(_ArrClient):
     def get_movies(self) -> list[dict]:
         return self._request("GET", "movie")
 
+    def get_movie(self, movie_id: int) -> dict:
+        return self._request("GET", f"movie/{movie_id}")
+
+    def get_history_since(self, since: float) -> list[dict]:
+        """History records (grabs, imports, renames, file deletions) newer than a Unix time."""
+        date = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since))
+        data = self._request("GET", "history/since", params={"date": date})
+        return data if isinstance(data, list) else []
+
+    def iter_movies(self) -> Iterator[dict]:
+        """Stream the movie list entry by entry instead of loading the whole document."""
+        return self._stream_list("movie")
+
     def rescan_movie(self, movie_id: int) -> Any:
         return self._request("POST", "command", json={"name": "RescanMovie", "movieId": movie_id})
 
     def refresh_movie(self, movie_id: int) -> Any:
         return self._request("POST", "command", json={"name": "RefreshMovie", "movieId": movie_id})
+
+
+def _is_within(path: str, directory: str) -> bool:
+    return path == directory or path.startswith(directory.rstrip("/") + "/")
+
+
+class PlexClient(_ArrClient):
+    """Plex Media Server: library sections and partial scans of single folders."""
+
+    service = "plex"
+    auth_header = "X-Plex-Token"
+
+    def __init__(self, base_url: str, token: str, *, policy: HttpPolicy = HttpPolicy()) -> None:
+        super().__init__(base_url, token, policy=policy)
+        self._session.headers["Accept"] = "application/json"
+
+    def get_sections(self) -> list[dict]:
+        data = self._request("GET", "library/sections")
+        return (data.get("MediaContainer") or {}).get("Directory") or []
+
+    def refresh_path(self, section_key: str, path: str) -> None:
+        """Scan only ``path`` (as Plex sees it) in a library section instead of the whole library."""
+        self._send("GET", f"library/sections/{section_key}/refresh", params={"path": path})
+
+    def scan_folders(self, folders: Iterable[str]) -> int:
+        """Send one partial scan per folder, to the section whose location contains it.
+
+        Folders outside every section are logged and skipped. Returns the number of scans sent.
+        """
+        locations = sorted(
+            (
+                (posixpath.normpath(location["path"]), str(section["key"]))
+                for section in self.get_sections()
+                for location in section.get("Location") or []
+                if location.get("path")
+            ),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        sent = 0
+        for folder in sorted(set(folders)):
+            section_key = next((key for path, key in locations if _is_within(folder, path)), None)
+            if section_key is None:
+                log.warning("No Plex library section contains %s", folder)
+                continue
+            self.refresh_path(section_key, folder)
+            sent += 1
+        return sent
@@ -1,21 +1,60 @@
-"""FastAPI app: health, web UI, and REST API for link rules and settings."""
+"""FastAPI app: health, metrics, web UI, REST API for link rules, settings and jobs, and *arr webhooks."""
 from __future__ import annotations
 
+import base64
+import codecs
+import csv
+import io
+import json
+import logging
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Iterator, Literal, Optional
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, PlainTextResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 
 import db
+import metrics
+import webhooks
 from config import get_settings
+from linker import LinkScope, run_link_job
+from scheduler import JobScheduler
+from watcher import MovieWatcher
+
+log = logging.getLogger(__name__)
 
 app = FastAPI(title="Plex Linker", version="3.0")
 _settings = get_settings()
 _UI_HTML = (Path(__file__).parent / "templates" / "index.html").read_text()
 
 
+def _run_job(scope: LinkScope, source: str) -> None:
+    try:
+        run_link_job(_settings, scope, source)
+    finally:
+        if movie_watcher is not None:
+            movie_watcher.refresh()
+
+
+scheduler = JobScheduler(_run_job)
+_webhook_triggers = webhooks.Debouncer(
+    lambda scope: scheduler.trigger(scope, "webhook"), delay=_settings.webhook_debounce_seconds
+)
+# Started by main.py in serve mode, like the scheduler.
+movie_watcher = (
+    MovieWatcher(
+        _settings.database_url,
+        webhooks.Debouncer(
+            lambda scope: scheduler.trigger(scope, "watcher"), delay=_settings.webhook_debounce_seconds
+        ).submit,
+    )
+    if _settings.watch_movies and _settings.database_url
+    else None
+)
+
+
 @app.on_event("startup")
 def _init_database() -> None:
     db.init_db(_settings.database_url)
@@ -35,6 +74,11 @@ def health() -> str:
     return "ok"
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics() -> Response:
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/", response_class=HTMLResponse)
 def root() -> HTMLResponse:
     return HTMLResponse(_UI_HTML)
@@ -52,11 +96,67 @@ class LinkRuleIn(BaseModel):
     episode_id: Optional[int] = None
     series_id: Optional[int] = None
     tvdb_id: Optional[int] = None
+    # The Sonarr instance episode_id and series_id belong to (SONARR_<N>_*); unset means 0.
+    sonarr_instance: Optional[int] = None
+
+
+def _encode_cursor(values: list[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def _is_sort_value(value: Any, column: Any) -> bool:
+    """Whether a cursor value can be compared with a sort column: its type (bools are not ints), or null."""
+    if value is None:
+        return column.nullable
+    return isinstance(value, column.type.python_type) and not isinstance(value, bool)
+
+
+def _decode_cursor(cursor: str, sort: str) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor") from None
+    columns = db.RULE_SORTS[sort]
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise HTTPException(400, "Invalid cursor")
+    if not all(_is_sort_value(value, column) for value, column in zip(values, columns)):
+        raise HTTPException(400, "Invalid cursor")
+    return values
 
 
 @app.get("/api/rules")
-def list_rules() -> list[dict]:
-    return db.list_rules(_db_url())
+def list_rules(
+    response: Response,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    sort: Literal["movie_title", "show_name", "tmdb_id", "id"] = "movie_title",
+    order: Literal["asc", "desc"] = "asc",
+    movie: Optional[str] = None,
+    show: Optional[str] = None,
+    tmdb_id: Optional[int] = None,
+    status: Optional[Literal["linked", "unlinked"]] = None,
+) -> list[dict]:
+    """Link rules, optionally filtered and paged.
+
+    With ``limit``, a full page sets the ``X-Next-Cursor`` header; pass it back as ``after``
+    (with the same sort and filters) for the next page. Without ``limit`` every match is returned.
+    """
+    page = max(1, min(limit, 1000)) if limit is not None else None
+    rules = db.list_rules(
+        _db_url(),
+        limit=page + 1 if page else None,
+        after=_decode_cursor(after, sort) if after else None,
+        sort=sort,
+        descending=order == "desc",
+        movie=movie,
+        show=show,
+        tmdb_id=tmdb_id,
+        linked=None if status is None else status == "linked",
+    )
+    if page and len(rules) > page:
+        rules = rules[:page]
+        response.headers["X-Next-Cursor"] = _encode_cursor(db.rule_sort_key(rules[-1], sort))
+    return rules
 
 
 @app.post("/api/rules", status_code=201)
@@ -72,12 +172,141 @@ def add_rule(rule: LinkRuleIn) -> dict:
         episode_id=rule.episode_id,
         series_id=rule.series_id,
         tvdb_id=rule.tvdb_id,
+        sonarr_instance=rule.sonarr_instance,
     )
     if rid is None:
         raise HTTPException(500, "Failed to add rule")
+    scheduler.trigger(LinkScope(targeted=True, rule_ids=frozenset({rid})), "rule")
     return {"id": rid, "movie_title": rule.movie_title, "show_name": rule.show_name}
 
 
+# --- Bulk import/export ---
+
+RULE_FIELDS = tuple(LinkRuleIn.model_fields)
+_REQUIRED_FIELDS = {"movie_title", "tmdb_id", "show_name"}
+# Rules per upsert statement on import, and per page read on export.
+_RULE_BATCH = 1000
+_MAX_REPORTED_ERRORS = 100
+
+
+async def _body_lines(request: Request) -> AsyncIterator[str]:
+    """Lines of the request body as it arrives, decoded as UTF-8 (a BOM is dropped)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending
+
+
+def _parse_rule(line: str, header: Optional[list[str]]) -> dict[str, Any]:
+    """One import line as a ``link_rules`` row; JSON when there is no CSV ``header``."""
+    if header is None:
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+    else:
+        values = next(csv.reader([line]))
+        if len(values) != len(header):
+            raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+        data = {k: v for k, v in zip(header, values) if v != ""}
+    return LinkRuleIn.model_validate(data).model_dump()
+
+
+def _csv_header(line: str) -> list[str]:
+    header = [name.strip() for name in next(csv.reader([line]))]
+    unknown = [name for name in header if name not in RULE_FIELDS]
+    missing = sorted(_REQUIRED_FIELDS - set(header))
+    if unknown or missing:
+        raise HTTPException(400, f"CSV header: unknown columns {unknown}, missing columns {missing}")
+    return header
+
+
+@app.post("/api/rules/bulk")
+async def import_rules(request: Request, format: Optional[Literal["jsonl", "csv"]] = None) -> dict:
+    """Upsert rules from JSON lines or CSV (with a header row) streamed in the body.
+
+    The format defaults to CSV for a ``text/csv`` content type, else JSON lines. Rules are
+    written in batches, each committed on its own; invalid lines are skipped and reported.
+    """
+    url = _db_url()
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "jsonl"
+    header: Optional[list[str]] = None
+    batch: dict[tuple[str, str], dict[str, Any]] = {}
+    imported = failed = 0
+    errors: list[dict[str, Any]] = []
+    line_no = 0
+    try:
+        async for line in _body_lines(request):
+            line_no += 1
+            if not line.strip():
+                continue
+            if format == "csv" and header is None:
+                header = _csv_header(line)
+                continue
+            try:
+                rule = _parse_rule(line, header)
+            except ValidationError as exc:
+                error = "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())
+            except ValueError as exc:
+                error = str(exc)
+            else:
+                # A later line for the same movie and show wins, as it would across batches.
+                batch[(rule["movie_title"], rule["show_name"])] = rule
+                imported += 1
+                if len(batch) >= _RULE_BATCH:
+                    await run_in_threadpool(db.upsert_rules, url, list(batch.values()))
+                    batch = {}
+                continue
+            failed += 1
+            if len(errors) < _MAX_REPORTED_ERRORS:
+                errors.append({"line": line_no, "error": error})
+    except UnicodeDecodeError:
+        raise HTTPException(400, f"Body is not valid UTF-8 (line {line_no + 1})") from None
+    await run_in_threadpool(db.upsert_rules, url, list(batch.values()))
+    if imported:
+        # New and changed rules have no matching rule_state, so an incremental run links just them.
+        scheduler.trigger(LinkScope(), "rule")
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+
+def _export_lines(url: str, format: str) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if format == "csv":
+        writer.writerow(RULE_FIELDS)
+    after: Optional[list[Any]] = None
+    while True:
+        page = db.list_rules(url, limit=_RULE_BATCH, after=after, sort="id")
+        for rule in page:
+            if format == "csv":
+                writer.writerow(["" if rule[k] is None else rule[k] for k in RULE_FIELDS])
+            else:
+                buffer.write(json.dumps({k: rule[k] for k in RULE_FIELDS}) + "\n")
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if len(page) < _RULE_BATCH:
+            return
+        after = db.rule_sort_key(page[-1], "id")
+
+
+@app.get("/api/rules/export")
+def export_rules(format: Literal["jsonl", "csv"] = "jsonl") -> StreamingResponse:
+    """Every rule as JSON lines or CSV, in the format ``/api/rules/bulk`` accepts, read page by page."""
+    url = _db_url()
+    return StreamingResponse(
+        _export_lines(url, format),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="plex-linker-rules.{format}"'},
+    )
+
+
 @app.delete("/api/rules/{rule_id}")
 def delete_rule_endpoint(rule_id: int) -> dict:
     if not db.delete_rule(_db_url(), rule_id):
@@ -85,6 +314,45 @@ def delete_rule_endpoint(rule_id: int) -> dict:
     return {"deleted": rule_id}
 
 
+# --- Jobs API ---
+
+
+class JobRunIn(BaseModel):
+    full: bool = False
+    rule_id: Optional[int] = None
+
+
+@app.get("/api/jobs")
+def list_jobs() -> dict:
+    return scheduler.status()
+
+
+@app.post("/api/jobs/run", status_code=202)
+def run_job(body: Optional[JobRunIn] = None) -> dict:
+    body = body or JobRunIn()
+    if body.rule_id is not None:
+        scope = LinkScope(targeted=True, rule_ids=frozenset({body.rule_id}))
+    else:
+        scope = LinkScope(full=body.full)
+    return scheduler.trigger(scope, "api").to_dict()
+
+
+# --- Run history API ---
+
+
+@app.get("/api/runs")
+def list_runs(limit: int = 50) -> list[dict]:
+    return db.list_runs(_db_url(), max(1, min(limit, 1000)))
+
+
+@app.get("/api/runs/{run_id}")
+def get_run(run_id: int) -> dict:
+    run = db.get_run(_db_url(), run_id)
+    if run is None:
+        raise HTTPException(404, "Run not found")
+    return run
+
+
 # --- Settings API ---
 
 
@@ -104,3 +372,25 @@ def get_setting(key: str) -> dict:
 def put_setting(key: str, body: SettingIn) -> dict:
     db.set_setting(_db_url(), key, body.value)
     return {"key": key, "value": body.value}
+
+
+# --- Webhooks ---
+
+
+def _queue_webhook(source: str, payload: dict, scope: Optional[LinkScope]) -> dict:
+    event = payload.get("eventType", "")
+    if scope is None:
+        return {"source": source, "event": event, "queued": False}
+    log.info("%s %s webhook: queueing targeted link run", source, event)
+    _webhook_triggers.submit(scope)
+    return {"source": source, "event": event, "queued": True}
+
+
+@app.post("/api/webhooks/radarr", status_code=202)
+def radarr_webhook(payload: dict[str, Any]) -> dict:
+    return _queue_webhook("radarr", payload, webhooks.radarr_scope(payload))
+
+
+@app.post("/api/webhooks/sonarr", status_code=202)
+def sonarr_webhook(payload: dict[str, Any]) -> dict:
+    return _queue_webhook("sonarr", payload, webhooks.sonarr_scope(payload))
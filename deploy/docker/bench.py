@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+"""
+Plex Linker benchmark.
+
+  run       — Build a synthetic Radarr/Sonarr library, a matching media tree and link rules under a
+              temp dir, run the link job end to end against a local fake Sonarr/Radarr, and report
+              wall time, API calls, filesystem calls and peak RSS per scenario (JSON output).
+  startup   — Time one-shot ``main.py`` processes under ``python -X importtime`` for the paths that
+              should stay cheap (no media root, no rules, nothing changed) and report wall time,
+              import time and which heavy packages each path loaded.
+  fake-arr  — The stand-in Sonarr/Radarr HTTP server; ``run`` and ``startup`` start it as a subprocess.
+
+  python bench.py run --movies 50000 --series 5000 --rules 10000 --latency-ms 5
+  python bench.py run --baseline bench-baseline.json --max-regression 10
+  python bench.py startup --baseline bench-startup-baseline.json --max-regression 20
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlsplit
+
+log = logging.getLogger(__name__)
+
+QUALITY = "Bluray-1080p"
+SCENARIOS = ("cold", "warm", "full")
+# os functions the linker reaches directly or through os.path/pathlib; counted during each run.
+FS_CALLS = ("stat", "lstat", "readlink", "symlink", "replace", "unlink", "scandir", "mkdir")
+COMPARED = ("wall_seconds", "api_calls", "api_bytes", "fs_calls", "peak_rss_kib")
+STARTUP_SCENARIOS = ("no-media-root", "no-rules", "warm")
+STARTUP_COMPARED = ("wall_seconds", "import_seconds", "modules")
+# Third-party packages whose import cost the one-shot paths should only pay when they need them.
+HEAVY_PACKAGES = ("sqlalchemy", "pg8000", "requests", "urllib3", "fastapi", "pydantic", "uvicorn")
+_MAIN_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+\d+ \| (\s*)(\S+)")
+
+
+# --- Synthetic library ---
+
+
+def _padding(title: str) -> dict[str, Any]:
+    """Fields the linker never reads, sized like a real *arr entry (~1.5 KB of JSON)."""
+    return {
+        "overview": f"{title} is a synthetic entry. " * 12,
+        "images": [
+            {
+                "coverType": kind,
+                "url": f"/MediaCover/{title}/{kind}.jpg",
+                "remoteUrl": f"https://image.example/{kind}/{title}.jpg",
+            }
+            for kind in ("poster", "fanart", "banner")
+        ],
+        "genres": ["Action", "Comedy", "Drama"],
+        "ratings": {"imdb": {"votes": 1234, "value": 7.1}, "tmdb": {"votes": 567, "value": 6.8}},
+        "alternateTitles": [{"title": f"{title} ({lang})", "language": lang} for lang in ("de", "fr", "ja")],
+    }
+
+
+def _movie(i: int) -> dict[str, Any]:
+    has_file = i % 20 != 19  # 5% of the library is not downloaded yet
+    movie = {
+        "id": i + 1,
+        "title": f"Movie {i}",
+        "tmdbId": 100000 + i,
+        "imdbId": f"tt{1000000 + i}",
+        "path": f"/movies/Movie {i} (2000)",
+        "hasFile": has_file,
+        **_padding(f"Movie {i}"),
+    }
+    if has_file:
+        movie["movieFile"] = {
+            "id": 500000 + i,
+            "relativePath": f"Movie {i} (2000) {QUALITY}.mkv",
+            "quality": {"quality": {"name": QUALITY}},
+        }
+    return movie
+
+
+def _series(j: int) -> dict[str, Any]:
+    return {
+        "id": j + 1,
+        "title": f"Show {j}",
+        "tvdbId": 300000 + j,
+        "path": f"/tv/Show {j}",
+        "seriesType": "anime" if j % 10 == 0 else "standard",
+        **_padding(f"Show {j}"),
+    }
+
+
+def _episodes(series_id: int, specials: int, regular: int) -> list[dict[str, Any]]:
+    eps = [(0, e) for e in range(1, specials + 1)] + [(1, e) for e in range(1, regular + 1)]
+    return [
+        {
+            "id": series_id * 10000 + season * 1000 + number,
+            "seriesId": series_id,
+            "seasonNumber": season,
+            "episodeNumber": number,
+            "title": f"{'Special' if season == 0 else 'Episode'} {number}",
+        }
+        for season, number in eps
+    ]
+
+
+def _rules(movies: int, series: int, rules: int) -> list[dict[str, Any]]:
+    """Rule k links movie k % movies to special k // series + 1 of show k % series."""
+    return [
+        {
+            "movie_title": f"Movie {k % movies}",
+            "tmdb_id": 100000 + k % movies,
+            "show_name": f"Show {k % series}",
+            "episode": k // series + 1,
+            "season": "00",
+        }
+        for k in range(rules)
+    ]
+
+
+def _build_media_tree(root: str, movies: int, series: int) -> None:
+    """Create every movie file and series folder, one entry at a time to keep this process small."""
+    for i in range(movies):
+        movie = _movie(i)
+        folder = os.path.join(root, movie["path"].lstrip("/"))
+        os.makedirs(folder, exist_ok=True)
+        if movie["hasFile"]:
+            open(os.path.join(folder, movie["movieFile"]["relativePath"]), "w").close()
+    for j in range(series):
+        os.makedirs(os.path.join(root, _series(j)["path"].lstrip("/")), exist_ok=True)
+
+
+# --- Fake Sonarr/Radarr ---
+
+
+def _serve_fake_arr(movies: int, series: int, latency: float, specials: int, regular: int) -> None:
+    """Serve the synthetic library as Sonarr and Radarr on two ports; print the ports as one JSON line."""
+    library = {"movies": [_movie(i) for i in range(movies)], "series": [_series(j) for j in range(series)]}
+    movies_body = json.dumps(library["movies"]).encode()
+    series_body = json.dumps(library["series"]).encode()
+    series_by_title = {s["title"]: s for s in library["series"]}
+    stats: Counter[str] = Counter()
+    stats_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; with Nagle on, keep-alive requests stall ~40ms.
+        disable_nagle_algorithm = True
+        service = ""
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def _send(self, body: bytes, status: int = 200) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _count(self, method: str, path: str, size: int) -> None:
+            endpoint = re.sub(r"/\d+(?=/|$)", "/{id}", path.split("/api/v3", 1)[-1])
+            with stats_lock:
+                stats[f"{self.service} {method} {endpoint}"] += 1
+                stats["_bytes"] += size
+
+        def _route_get(self, path: str, query: dict[str, list[str]]) -> tuple[int, bytes]:
+            if path == "/movie":
+                return 200, movies_body
+            if path == "/series":
+                return 200, series_body
+            if path == "/series/lookup":
+                found = series_by_title.get(query.get("term", [""])[0])
+                return 200, json.dumps([found] if found else []).encode()
+            if path == "/episode":
+                series_id = int(query.get("seriesId", ["0"])[0])
+                return 200, json.dumps(_episodes(series_id, specials, regular)).encode()
+            match = re.fullmatch(r"/episode/(\d+)", path)
+            if match:
+                episode_id = int(match.group(1))
+                series_eps = _episodes(episode_id // 10000, specials, regular)
+                found = next((e for e in series_eps if e["id"] == episode_id), None)
+                return (200, json.dumps(found).encode()) if found else (404, b"{}")
+            match = re.fullmatch(r"/movie/(\d+)", path)
+            if match and 0 < int(match.group(1)) <= len(library["movies"]):
+                return 200, json.dumps(library["movies"][int(match.group(1)) - 1]).encode()
+            if path == "/history/since":
+                # The library never changes while the bench runs.
+                return 200, b"[]"
+            if path == "/rootfolder":
+                return 200, b"[]"
+            return 404, b"{}"
+
+        def do_GET(self) -> None:
+            url = urlsplit(self.path)
+            if url.path == "/_stats":
+                with stats_lock:
+                    body = json.dumps(stats).encode()
+                    if "reset" in url.query:
+                        stats.clear()
+                return self._send(body)
+            time.sleep(latency)
+            path = url.path.split("/api/v3", 1)[-1]
+            status, body = self._route_get(path, parse_qs(url.query))
+            self._count("GET", path, len(body))
+            self._send(body, status)
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            command = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(latency)
+            body = json.dumps({"id": 1, "name": command.get("name", "")}).encode()
+            self._count("POST", f"/command/{command.get('name', '')}", len(body))
+            self._send(body, 201)
+
+    servers = {}
+    for service in ("sonarr", "radarr"):
+        handler = type(f"{service.title()}Handler", (Handler,), {"service": service})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[service] = server.server_port
+    print(json.dumps(servers), flush=True)
+    threading.Event().wait()
+
+
+def _http_json(url: str) -> Any:
+    import requests
+
+    resp = requests.get(url, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+
+# --- Measurement ---
+
+
+class _FsCallCounter:
+    """Count calls to the os functions in FS_CALLS from every thread while active."""
+
+    def __init__(self) -> None:
+        self.counts: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._originals: dict[str, Callable[..., Any]] = {}
+
+    def _wrap(self, name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        def counted(*args: Any, **kwargs: Any) -> Any:
+            with self._lock:
+                self.counts[name] += 1
+            return fn(*args, **kwargs)
+
+        return counted
+
+    def __enter__(self) -> _FsCallCounter:
+        for name in FS_CALLS:
+            self._originals[name] = getattr(os, name)
+            setattr(os, name, self._wrap(name, self._originals[name]))
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        for name, fn in self._originals.items():
+            setattr(os, name, fn)
+
+
+def _count_links(media_root: str) -> int:
+    count = 0
+    for dirpath, _, filenames in os.walk(os.path.join(media_root, "tv")):
+        count += sum(os.path.islink(os.path.join(dirpath, f)) for f in filenames)
+    return count
+
+
+def _run_scenario(name: str, settings: Any, stats_url: str) -> dict[str, Any]:
+    from linker import LinkScope, run_link_job
+
+    _http_json(f"{stats_url}?reset=1")
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    with _FsCallCounter() as fs:
+        run_link_job(settings, LinkScope(full=name == "full"), source="bench")
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    api = _http_json(stats_url)
+    api_bytes = api.pop("_bytes", 0)
+    return {
+        "name": name,
+        "wall_seconds": round(wall, 4),
+        "cpu_user_seconds": round(after.ru_utime - usage.ru_utime, 4),
+        "cpu_system_seconds": round(after.ru_stime - usage.ru_stime, 4),
+        "api_calls": sum(api.values()),
+        "api_bytes": api_bytes,
+        "api_by_endpoint": dict(sorted(api.items())),
+        "fs_calls": sum(fs.counts.values()),
+        "fs_by_call": dict(sorted(fs.counts.items())),
+        # ru_maxrss is KiB on Linux and never decreases, so later scenarios report the process peak.
+        "peak_rss_kib": after.ru_maxrss,
+        "links": _count_links(settings.media_root),
+    }
+
+
+def _start_fake_arr(
+    movies: int, series: int, latency_ms: float, specials: int, regular: int
+) -> tuple[subprocess.Popen, dict[str, int]]:
+    """Start ``fake-arr`` in a subprocess; return it and its ``{"sonarr": port, "radarr": port}``."""
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "fake-arr",
+            "--movies",
+            str(movies),
+            "--series",
+            str(series),
+            "--latency-ms",
+            str(latency_ms),
+            "--specials",
+            str(specials),
+            "--regular-episodes",
+            str(regular),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert server.stdout is not None
+    return server, json.loads(server.stdout.readline())
+
+
+def _compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    max_regression: float,
+    compared: tuple[str, ...] = COMPARED,
+) -> bool:
+    """Print current vs baseline per scenario; return False when a metric regressed too far."""
+    ok = True
+    base_runs = {r["name"]: r for r in baseline.get("scenarios", [])}
+    print(f"\n{'scenario':<14}{'metric':<16}{'baseline':>14}{'current':>14}{'change':>10}")
+    for run in results["scenarios"]:
+        base = base_runs.get(run["name"])
+        if not base:
+            continue
+        for metric in compared:
+            old, new = base.get(metric), run.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            flag = ""
+            if max_regression and change > max_regression:
+                flag, ok = "  !", False
+            print(f"{run['name']:<14}{metric:<16}{old:>14}{new:>14}{change:>9.1f}%{flag}")
+    return ok
+
+
+def _bench(args: argparse.Namespace) -> int:
+    import dataclasses
+
+    import db
+    from config import ArrInstance, get_settings
+
+    if args.rules > math.lcm(args.movies, args.series):
+        raise SystemExit("--rules must not exceed lcm(--movies, --series) so every rule is unique")
+    specials = math.ceil(args.rules / args.series) + 2
+    work = tempfile.mkdtemp(prefix="plex-linker-bench-")
+    media_root = os.path.join(work, "media")
+    server = None
+    try:
+        t = time.perf_counter()
+        _build_media_tree(media_root, args.movies, args.series)
+        database_url = f"sqlite:///{work}/bench.db"
+        db.init_db(database_url)
+        with db.get_engine(database_url).begin() as conn:
+            conn.execute(db.link_rules.insert(), _rules(args.movies, args.series, args.rules))
+        log.info("Generated library and media tree in %.1fs (%s)", time.perf_counter() - t, work)
+
+        server, ports = _start_fake_arr(
+            args.movies, args.series, args.latency_ms, specials, args.regular_episodes
+        )
+        settings = dataclasses.replace(
+            get_settings(),
+            database_url=database_url,
+            media_root=media_root,
+            sonarr_instances=(ArrInstance(0, f"http://127.0.0.1:{ports['sonarr']}", api_key="bench"),),
+            radarr_instances=(ArrInstance(0, f"http://127.0.0.1:{ports['radarr']}", api_key="bench"),),
+            link_workers=args.workers,
+            http_rate_per_second=args.rate,
+            link_audit=False,
+            shard_rules=False,
+        )
+        stats_url = f"http://127.0.0.1:{ports['sonarr']}/_stats"
+        results: dict[str, Any] = {
+            "meta": {
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "movies": args.movies,
+                "series": args.series,
+                "rules": args.rules,
+                "latency_ms": args.latency_ms,
+                "workers": args.workers,
+                "rate_per_second": args.rate,
+            },
+            "scenarios": [],
+        }
+        for name in args.scenarios.split(","):
+            run = _run_scenario(name, settings, stats_url)
+            results["scenarios"].append(run)
+            print(
+                f"{name:<6} {run['wall_seconds']:>8.2f}s  api={run['api_calls']} "
+                f"({run['api_bytes'] // 1024} KiB)  fs={run['fs_calls']}  "
+                f"rss={run['peak_rss_kib'] // 1024} MiB  links={run['links']}"
+            )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not _compare(results, json.load(f), args.max_regression):
+                return 1
+    return 0
+
+
+def _import_profile(stderr: str) -> tuple[float, int, set[str]]:
+    """Total self import time (seconds), module count and top-level packages from ``-X importtime``."""
+    total_us = 0
+    modules = 0
+    packages: set[str] = set()
+    for line in stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if not match:
+            continue
+        total_us += int(match.group(1))
+        modules += 1
+        packages.add(match.group(3).split(".", 1)[0])
+    return total_us / 1e6, modules, packages
+
+
+def _startup_scenario(name: str, env: dict[str, str], repeat: int) -> dict[str, Any]:
+    walls: list[float] = []
+    imports: list[float] = []
+    modules = 0
+    packages: set[str] = set()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", _MAIN_PY],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        walls.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise SystemExit(f"{name}: main.py exited with {proc.returncode}\n{proc.stderr[-2000:]}")
+        seconds, modules, packages = _import_profile(proc.stderr)
+        imports.append(seconds)
+    return {
+        "name": name,
+        "wall_seconds": round(statistics.median(walls), 4),
+        "import_seconds": round(statistics.median(imports), 4),
+        "modules": modules,
+        "heavy_packages": sorted(packages & set(HEAVY_PACKAGES)),
+    }
+
+
+def _bench_startup(args: argparse.Namespace) -> int:
+    import db
+
+    work = tempfile.mkdtemp(prefix="plex-linker-startup-")
+    media_root = os.path.join(work, "media")
+    database_url = f"sqlite:///{work}/startup.db"
+    os.makedirs(media_root)
+    db.init_db(database_url)
+    base_env = {
+        **{k: v for k, v in os.environ.items() if not re.match(r"(SONARR|RADARR)_", k)},
+        "DATABASE_URL": database_url,
+        "MEDIA_ROOT": media_root,
+        "PLEX_LINKER_SHARD_RULES": "false",
+        "PLEX_LINKER_LINK_AUDIT": "false",
+    }
+    server = None
+    ports: dict[str, int] = {}
+    results: dict[str, Any] = {
+        "params": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "movies": args.movies,
+        },
+        "scenarios": [],
+    }
+    try:
+        for name in args.scenarios.split(","):
+            env = dict(base_env)
+            if name == "no-media-root":
+                env.update(MEDIA_ROOT="", DOCKER_MEDIA_PATH="", HOST_MEDIA_PATH="")
+            elif name == "warm":
+                if server is None:
+                    _build_media_tree(media_root, args.movies, args.movies)
+                    with db.get_engine(database_url).begin() as conn:
+                        conn.execute(db.link_rules.insert(), _rules(args.movies, args.movies, args.movies))
+                    server, ports = _start_fake_arr(args.movies, args.movies, 0, 3, 1)
+                env.update(
+                    SONARR_0_URL=f"http://127.0.0.1:{ports['sonarr']}",
+                    SONARR_0_API_KEY="bench",
+                    RADARR_0_URL=f"http://127.0.0.1:{ports['radarr']}",
+                    RADARR_0_API_KEY="bench",
+                )
+                # The first run creates the links and the library snapshot; the timed ones change nothing.
+                subprocess.run(
+                    [sys.executable, _MAIN_PY],
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=True,
+                )
+            run = _startup_scenario(name, env, args.repeat)
+            results["scenarios"].append(run)
+            print(
+                f"{name:<14} {run['wall_seconds']:>7.3f}s  imports={run['import_seconds']:.3f}s "
+                f"modules={run['modules']}  heavy={','.join(run['heavy_packages']) or '-'}"
+            )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not _compare(results, json.load(f), args.max_regression, STARTUP_COMPARED):
+                return 1
+    return 0
+
+
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s  %(name)-14s  %(levelname)-8s  %(message)s")
+
+parser = argparse.ArgumentParser(prog="plex-linker-bench")
+sub = parser.add_subparsers(dest="command", required=True)
+
+run_p = sub.add_parser("run", help="benchmark the link job end to end")
+run_p.add_argument("--movies", type=int, default=50000)
+run_p.add_argument("--series", type=int, default=5000)
+run_p.add_argument("--rules", type=int, default=10000)
+run_p.add_argument("--regular-episodes", type=int, default=20, help="season 1 episodes per series")
+run_p.add_argument("--latency-ms", type=float, default=0, help="added to every fake *arr response")
+run_p.add_argument("--workers", type=int, default=4, help="PLEX_LINKER_LINK_WORKERS for the run")
+run_p.add_argument("--rate", type=float, default=0, help="HTTP rate limit per host (0 = unlimited)")
+run_p.add_argument(
+    "--scenarios",
+    default=",".join(SCENARIOS),
+    help="comma-separated, in order: cold (empty tree), warm (nothing changed), full (--full)",
+)
+run_p.add_argument("--output", default="bench-results.json")
+run_p.add_argument("--baseline", help="earlier results file to compare against")
+run_p.add_argument(
+    "--max-regression",
+    type=float,
+    default=0,
+    help="exit 1 when a compared metric is this many percent worse than the baseline (0 = report only)",
+)
+run_p.add_argument("--keep", action="store_true", help="keep the generated temp dir")
+
+startup_p = sub.add_parser("startup", help="benchmark one-shot process startup with -X importtime")
+startup_p.add_argument(
+    "--scenarios",
+    default=",".join(STARTUP_SCENARIOS),
+    help="comma-separated: no-media-root, no-rules (empty rule table), warm (nothing changed)",
+)
+startup_p.add_argument("--repeat", type=int, default=5, help="processes per scenario; the median is reported")
+startup_p.add_argument("--movies", type=int, default=200, help="library and rule count for the warm scenario")
+startup_p.add_argument("--output", default="bench-startup.json")
+startup_p.add_argument("--baseline", help="earlier results file to compare against")
+startup_p.add_argument(
+    "--max-regression",
+    type=float,
+    default=0,
+    help="exit 1 when a compared metric is this many percent worse than the baseline (0 = report only)",
+)
+
+fake_p = sub.add_parser("fake-arr", help="serve a generated library as Sonarr and Radarr")
+fake_p.add_argument("--movies", type=int, default=50000)
+fake_p.add_argument("--series", type=int, default=5000)
+fake_p.add_argument("--latency-ms", type=float, default=0)
+fake_p.add_argument("--specials", type=int, default=5)
+fake_p.add_argument("--regular-episodes", type=int, default=20)
+
+args = parser.parse_args()
+
+if args.command == "fake-arr":
+    _serve_fake_arr(args.movies, args.series, args.latency_ms / 1000, args.specials, args.regular_episodes)
+elif args.command == "startup":
+    sys.exit(_bench_startup(args))
+else:
+    log.setLevel(logging.INFO)
+    sys.exit(_bench(args))
@@ -0,0 +1,493 @@
+"""Per-run indexes over the Radarr and Sonarr libraries so rule resolution is O(1), and the
+persisted snapshot they are loaded from between runs."""
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterable, Iterator, NamedTuple, Optional, Sequence
+
+import requests
+
+import cluster
+import db
+
+if TYPE_CHECKING:
+    from api_clients import RadarrClient, SonarrClient
+
+log = logging.getLogger(__name__)
+
+# Re-read this much history before the last sync so clock skew with Radarr cannot hide an event.
+_HISTORY_OVERLAP = 300.0
+# Radarr history events that never change a movie's file.
+_IGNORED_EVENTS = frozenset({"grabbed", "downloadFailed", "downloadIgnored"})
+
+
+class KeyedLocks:
+    """A lock per key, so concurrent workers serialize on the same key and nothing else."""
+
+    def __init__(self) -> None:
+        self._locks: dict[Hashable, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def __call__(self, key: Hashable) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+
+class MovieRecord(NamedTuple):
+    """The subset of a Radarr movie entry that the linker reads, and the instance it came from."""
+
+    id: int
+    tmdb_id: int
+    imdb_id: str
+    path: str
+    has_file: bool
+    movie_file_id: int
+    relative_path: str
+    quality: str
+    instance: int = 0
+
+    @classmethod
+    def from_radarr(cls, movie: dict[str, Any], instance: int = 0) -> MovieRecord:
+        movie_file = movie.get("movieFile") or {}
+        quality = ((movie_file.get("quality") or {}).get("quality") or {}).get("name", "")
+        return cls(
+            id=movie.get("id") or 0,
+            tmdb_id=movie.get("tmdbId") or 0,
+            imdb_id=movie.get("imdbId") or "",
+            path=movie.get("path") or "",
+            has_file=bool(movie.get("hasFile")),
+            movie_file_id=movie_file.get("id") or 0,
+            relative_path=movie_file.get("relativePath") or "",
+            quality=quality or "",
+            instance=instance,
+        )
+
+
+def _prefer(index: dict[Any, MovieRecord], key: Any, record: MovieRecord) -> None:
+    current = index.get(key)
+    if current is None or (record.has_file and not current.has_file):
+        index[key] = record
+
+
+class RadarrCatalog:
+    """Radarr libraries indexed by TMDB ID, IMDb ID and (instance, Radarr movie ID).
+
+    Built once per run from every instance's ``load_radarr_movies``, in instance order. When
+    several entries share a TMDB or IMDb ID, the first one with a downloaded file wins, else
+    the first one: a lower-numbered instance takes precedence unless only another has the file.
+    """
+
+    def __init__(self, movies: Iterable[MovieRecord]) -> None:
+        self._by_tmdb: dict[int, MovieRecord] = {}
+        self._by_imdb: dict[str, MovieRecord] = {}
+        self._by_id: dict[tuple[int, int], MovieRecord] = {}
+        for record in movies:
+            self.add(record)
+
+    def add(self, record: MovieRecord) -> None:
+        if record.tmdb_id:
+            _prefer(self._by_tmdb, record.tmdb_id, record)
+        if record.imdb_id:
+            _prefer(self._by_imdb, record.imdb_id, record)
+        if record.id:
+            self._by_id.setdefault((record.instance, record.id), record)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def by_tmdb(self, tmdb_id: int) -> Optional[MovieRecord]:
+        return self._by_tmdb.get(tmdb_id)
+
+    def by_imdb(self, imdb_id: str) -> Optional[MovieRecord]:
+        return self._by_imdb.get(imdb_id)
+
+    def by_id(self, instance: int, movie_id: int) -> Optional[MovieRecord]:
+        return self._by_id.get((instance, movie_id))
+
+
+class SeriesRecord(NamedTuple):
+    """The subset of a Sonarr series entry that the linker reads, and the instance it came from."""
+
+    id: int
+    title: str
+    tvdb_id: int
+    path: str
+    series_type: str
+    instance: int = 0
+
+    @classmethod
+    def from_sonarr(cls, series: dict[str, Any], instance: int = 0) -> SeriesRecord:
+        return cls(
+            id=series.get("id") or 0,
+            title=series.get("title") or "",
+            tvdb_id=series.get("tvdbId") or 0,
+            path=str(series.get("path") or ""),
+            series_type=series.get("seriesType") or "",
+            instance=instance,
+        )
+
+
+def normalize_title(title: str) -> str:
+    """Case- and punctuation-insensitive key for matching show names to Sonarr titles.
+
+    Letters and digits of every script are kept, so non-Latin titles get a key of their own;
+    a title with none (e.g. only punctuation) gets ``""``, which is never indexed.
+    """
+    return re.sub(r"[\W_]+", "", title.casefold())
+
+
+class SonarrIndex:
+    """Sonarr libraries indexed by (instance, series ID), TVDB ID and normalized title.
+
+    Built once per run from every instance's ``load_sonarr_series``, in instance order, so for a
+    TVDB ID or title in several instances the lowest-numbered instance wins. ``resolve`` prefers
+    the IDs stored on a rule, then the title, and only falls back to the remote ``series/lookup``
+    search on a miss. Remote results (including misses) are remembered for the rest of the run,
+    and library series found that way are collected in ``fetched``. Safe to share between
+    worker threads; concurrent misses on the same title trigger a single remote lookup.
+    """
+
+    def __init__(self, series: Iterable[SeriesRecord]) -> None:
+        self._by_id: dict[tuple[int, int], SeriesRecord] = {}
+        self._by_tvdb: dict[int, SeriesRecord] = {}
+        self._by_title: dict[str, SeriesRecord] = {}
+        self._lookups: dict[str, Optional[SeriesRecord]] = {}
+        self._lookup_locks = KeyedLocks()
+        self.fetched: list[SeriesRecord] = []
+        for record in series:
+            self.add(record)
+
+    def add(self, record: SeriesRecord) -> None:
+        if record.id:
+            self._by_id.setdefault((record.instance, record.id), record)
+        if record.tvdb_id:
+            self._by_tvdb.setdefault(record.tvdb_id, record)
+        key = normalize_title(record.title)
+        if key:
+            self._by_title.setdefault(key, record)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self) -> Iterator[SeriesRecord]:
+        return iter(list(self._by_id.values()))
+
+    def by_id(self, instance: int, series_id: int) -> Optional[SeriesRecord]:
+        return self._by_id.get((instance, series_id))
+
+    def by_tvdb(self, tvdb_id: int) -> Optional[SeriesRecord]:
+        return self._by_tvdb.get(tvdb_id)
+
+    def by_title(self, title: str) -> Optional[SeriesRecord]:
+        key = normalize_title(title)
+        return self._by_title.get(key) if key else None
+
+    def find(
+        self,
+        show_name: str,
+        *,
+        instance: int = 0,
+        series_id: Optional[int] = None,
+        tvdb_id: Optional[int] = None,
+    ) -> Optional[SeriesRecord]:
+        """The library series for a show rule from the index alone, or None; never asks Sonarr."""
+        return (
+            (series_id and self.by_id(instance, series_id))
+            or (tvdb_id and self.by_tvdb(tvdb_id))
+            or self.by_title(show_name)
+        )
+
+    def resolve(
+        self,
+        sonarrs: Sequence[SonarrClient],
+        show_name: str,
+        *,
+        instance: int = 0,
+        series_id: Optional[int] = None,
+        tvdb_id: Optional[int] = None,
+    ) -> Optional[SeriesRecord]:
+        """Return the series for a show rule, or None when no Sonarr instance knows it.
+
+        ``series_id`` is looked up in ``instance``; remote lookups ask each of ``sonarrs`` in
+        order until one knows the title.
+        """
+        record = self.find(show_name, instance=instance, series_id=series_id, tvdb_id=tvdb_id)
+        if record:
+            return record
+
+        key = normalize_title(show_name)
+        if not key:
+            # No key to share the result under: every such title is looked up on its own.
+            return self._lookup(sonarrs, show_name)
+        with self._lookup_locks(key):
+            if key in self._lookups:
+                return self._lookups[key]
+            record = self._lookup(sonarrs, show_name)
+            self._lookups[key] = record
+            return record
+
+    def _lookup(self, sonarrs: Sequence[SonarrClient], show_name: str) -> Optional[SeriesRecord]:
+        """Ask each Sonarr in turn to look up a title; a library series found is indexed."""
+        record = None
+        for sonarr in sonarrs:
+            data = sonarr.lookup_series(show_name)
+            record = SeriesRecord.from_sonarr(data, sonarr.instance) if data else None
+            if record and record.id:
+                break
+        if record and record.id:
+            self.add(record)
+            self.fetched.append(record)
+        return record
+
+
+def _snapshot_is_fresh(sync: Optional[dict[str, Any]], max_age: float, now: float) -> bool:
+    return bool(sync) and now - sync["full_at"] < max_age
+
+
+def _download(
+    db_url: str,
+    service: str,
+    instance: int,
+    seen: Optional[dict[str, Any]],
+    fetch: Callable[[], list[Any]],
+    record_type: Callable[..., Any],
+    lease_ttl: float,
+) -> list[Any]:
+    """Fetch an instance's whole library and make it the snapshot.
+
+    With ``lease_ttl`` (several replicas) the download holds the ``catalog/<service>/<instance>``
+    lease: one replica downloads, and a replica that waited for it reads the snapshot instead
+    when it was fetched in full after ``seen``, the sync state this run started from.
+    """
+    with ExitStack() as stack:
+        if lease_ttl > 0:
+            stack.enter_context(cluster.lease(db_url, f"catalog/{service}/{instance}", ttl=lease_ttl))
+            latest = db.get_catalog_sync(db_url, service, instance)
+            if latest and (not seen or latest["full_at"] > seen["full_at"]):
+                return [record_type(**row) for row in db.list_catalog(db_url, service, instance)]
+        now = time.time()
+        records = fetch()
+        db.replace_catalog(db_url, service, instance, [r._asdict() for r in records], now)
+        return records
+
+
+def load_radarr_movies(
+    db_url: str,
+    radarr: RadarrClient,
+    *,
+    max_age: float,
+    stream: bool,
+    refresh: bool = False,
+    lease_ttl: float = 0,
+) -> list[MovieRecord]:
+    """One instance's movies from the persisted snapshot, brought up to date from its history.
+
+    The full library is downloaded (streamed when ``stream``) only when there is no snapshot, it
+    is older than ``max_age`` seconds, ``refresh`` is set, or the history cannot be read.
+    Otherwise only movies with history events since the last sync are re-fetched. ``max_age``
+    <= 0 disables the snapshot. ``lease_ttl`` makes replicas take turns downloading.
+    """
+    movies = radarr.iter_movies if stream else radarr.get_movies
+    if max_age <= 0:
+        return [MovieRecord.from_radarr(movie, radarr.instance) for movie in movies()]
+
+    now = time.time()
+    sync = db.get_catalog_sync(db_url, "radarr", radarr.instance)
+    if not refresh and _snapshot_is_fresh(sync, max_age, now):
+        try:
+            return _sync_radarr(db_url, radarr, sync["synced_at"], now)
+        except requests.RequestException:
+            log.warning("Radarr history unavailable, fetching the full library", exc_info=True)
+
+    return _download(
+        db_url,
+        "radarr",
+        radarr.instance,
+        sync,
+        lambda: [MovieRecord.from_radarr(movie, radarr.instance) for movie in movies()],
+        MovieRecord,
+        lease_ttl,
+    )
+
+
+def _sync_radarr(db_url: str, radarr: RadarrClient, synced_at: float, now: float) -> list[MovieRecord]:
+    """Apply Radarr history since the last sync to the snapshot, one ``GET movie/{id}`` per movie."""
+    events = radarr.get_history_since(synced_at - _HISTORY_OVERLAP)
+    changed = {
+        e["movieId"] for e in events if e.get("movieId") and e.get("eventType") not in _IGNORED_EVENTS
+    }
+    records = {
+        row["id"]: MovieRecord(**row) for row in db.list_catalog(db_url, "radarr", radarr.instance)
+    }
+    updated: list[MovieRecord] = []
+    deleted: list[int] = []
+    for movie_id in sorted(changed):
+        try:
+            record = MovieRecord.from_radarr(radarr.get_movie(movie_id), radarr.instance)
+        except requests.HTTPError as exc:
+            if exc.response is None or exc.response.status_code != 404:
+                raise
+            if records.pop(movie_id, None):
+                deleted.append(movie_id)
+            continue
+        if records.get(movie_id) != record:
+            records[movie_id] = record
+            updated.append(record)
+    db.update_catalog(
+        db_url, "radarr", radarr.instance, [r._asdict() for r in updated], deleted, synced_at=now
+    )
+    if changed:
+        log.info(
+            "Radarr %d snapshot: %d movies in history, %d changed, %d deleted",
+            radarr.instance,
+            len(changed),
+            len(updated),
+            len(deleted),
+        )
+    return list(records.values())
+
+
+def load_sonarr_series(
+    db_url: str,
+    sonarr: SonarrClient,
+    *,
+    max_age: float,
+    stream: bool,
+    refresh: bool = False,
+    lease_ttl: float = 0,
+) -> list[SeriesRecord]:
+    """One instance's series from the persisted snapshot while it is younger than ``max_age`` seconds.
+
+    Series added since the snapshot are found by ``SonarrIndex.resolve``'s remote lookup; persist
+    them with ``save_series_lookups``. ``max_age`` <= 0 disables the snapshot. ``lease_ttl``
+    makes replicas take turns downloading.
+    """
+    series = sonarr.iter_series if stream else sonarr.get_series
+    if max_age <= 0:
+        return [SeriesRecord.from_sonarr(entry, sonarr.instance) for entry in series()]
+
+    sync = db.get_catalog_sync(db_url, "sonarr", sonarr.instance)
+    if not refresh and _snapshot_is_fresh(sync, max_age, time.time()):
+        return [SeriesRecord(**row) for row in db.list_catalog(db_url, "sonarr", sonarr.instance)]
+
+    return _download(
+        db_url,
+        "sonarr",
+        sonarr.instance,
+        sync,
+        lambda: [SeriesRecord.from_sonarr(entry, sonarr.instance) for entry in series()],
+        SeriesRecord,
+        lease_ttl,
+    )
+
+
+def save_series_lookups(db_url: str, index: SonarrIndex) -> None:
+    """Add the library series that remote lookups found during the run to each instance's snapshot."""
+    by_instance: dict[int, list[dict[str, Any]]] = {}
+    for record in index.fetched:
+        by_instance.setdefault(record.instance, []).append(record._asdict())
+    for instance, rows in sorted(by_instance.items()):
+        db.update_catalog(db_url, "sonarr", instance, rows, [])
+
+
+class EpisodeCache:
+    """Season 0 episodes per (Sonarr instance, series), keyed ``{(season, episode): episode}``.
+
+    Each series' episode list is downloaded at most once while its entry is live. With the
+    defaults the cache lives for a single run; with ``ttl_seconds`` it can be kept across
+    scheduled runs, and ``max_series`` bounds it by evicting the least recently used series.
+    """
+
+    def __init__(self, *, ttl_seconds: float = 0, max_series: int = 0) -> None:
+        self._ttl = ttl_seconds
+        self._max_series = max_series
+        self._entries: OrderedDict[tuple[int, int], tuple[float, dict[tuple[int, int], dict]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetch_locks = KeyedLocks()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _cached(self, key: tuple[int, int]) -> Optional[dict[tuple[int, int], dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or (self._ttl and time.monotonic() - entry[0] >= self._ttl):
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def forget(self, series_ids: Iterable[int]) -> None:
+        """Drop the cached lists of these series in every instance, so the next read refetches them."""
+        series_ids = set(series_ids)
+        with self._lock:
+            for key in [key for key in self._entries if key[1] in series_ids]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def specials(self, sonarr: SonarrClient, series_id: int) -> dict[tuple[int, int], dict]:
+        key = (sonarr.instance, series_id)
+        index = self._cached(key)
+        if index is not None:
+            return index
+        with self._fetch_locks(key):
+            index = self._cached(key)
+            if index is None:
+                index = self._fetch(sonarr, series_id)
+        return index
+
+    def _fetch(self, sonarr: SonarrClient, series_id: int) -> dict[tuple[int, int], dict]:
+        index: dict[tuple[int, int], dict] = {}
+        for ep in sonarr.get_episodes(series_id):
+            try:
+                key = (int(ep.get("seasonNumber", -1)), int(ep.get("episodeNumber", -1)))
+            except (TypeError, ValueError):
+                continue
+            if key[0] == 0:
+                index.setdefault(key, ep)
+
+        with self._lock:
+            key = (sonarr.instance, series_id)
+            self._entries[key] = (time.monotonic(), index)
+            self._entries.move_to_end(key)
+            if self._max_series:
+                while len(self._entries) > self._max_series:
+                    self._entries.popitem(last=False)
+        return index
+
+    def special(
+        self, sonarr: SonarrClient, series_id: int, episode: int, episode_id: Optional[int] = None
+    ) -> Optional[dict]:
+        """Return the Season 0 episode numbered ``episode`` for the series, if any.
+
+        With the rule's stored ``episode_id`` and no cached list for the series, only that
+        episode is fetched; the list is fetched instead when it is gone (404) or no longer is
+        that special of that series.
+        """
+        if not isinstance(episode, int):
+            return None
+        if episode_id and self._cached((sonarr.instance, series_id)) is None:
+            stored = self._stored(sonarr, episode_id)
+            key = stored and (stored.get("seriesId"), stored.get("seasonNumber"), stored.get("episodeNumber"))
+            if key == (series_id, 0, episode):
+                return stored
+        return self.specials(sonarr, series_id).get((0, episode))
+
+    @staticmethod
+    def _stored(sonarr: SonarrClient, episode_id: int) -> Optional[dict]:
+        try:
+            return sonarr.get_episode(episode_id)
+        except requests.HTTPError as exc:
+            if exc.response is None or exc.response.status_code != 404:
+                raise
+            return None
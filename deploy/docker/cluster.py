@@ -0,0 +1,141 @@
+"""Coordination between replicas sharing one database: a job lease and rule sharding."""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Iterator, NamedTuple, Optional
+
+import db
+
+log = logging.getLogger(__name__)
+
+# Pod name under Kubernetes; the pid keeps a cron run and a server on one host apart.
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+LINK_JOB_LEASE = "link-job"
+# Each replica's sharded run holds "link-job/<holder>"; the job lease excludes all of them.
+SHARD_LEASE_PREFIX = f"{LINK_JOB_LEASE}/"
+
+
+class Shard(NamedTuple):
+    """This replica's slice of the rules: those whose key hashes to ``index`` modulo ``count``."""
+
+    index: int
+    count: int
+
+    def owns(self, key: str) -> bool:
+        return zlib.crc32(key.encode()) % self.count == self.index
+
+
+def _renew_every(interval: float, renew: Callable[[], object], stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        try:
+            renew()
+        except Exception:
+            log.exception("Failed to renew lease/heartbeat")
+
+
+@contextmanager
+def _renewing(db_url: str, name: str, ttl: float) -> Iterator[None]:
+    """Keep renewing an acquired lease until the block exits, then release it."""
+    stop = threading.Event()
+    renewer = threading.Thread(
+        target=_renew_every,
+        args=(ttl / 3, lambda: db.acquire_lease(db_url, name, HOLDER, ttl), stop),
+        name="lease-renew",
+        daemon=True,
+    )
+    renewer.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        renewer.join()
+        db.release_lease(db_url, name, HOLDER)
+
+
+@contextmanager
+def job_lease(db_url: str, *, ttl: float, wait: bool) -> Iterator[bool]:
+    """Hold the link-job lease for the duration of the block, renewing it in the background.
+
+    Yields False when another replica holds it (after waiting for it to be free if ``wait``).
+    Once held, waits for sharded runs still in progress (``shard_lease``) to finish, so the
+    block runs alone. A replica that dies stops renewing, so its lease expires after ``ttl``
+    seconds.
+    """
+    acquired = db.acquire_lease(db_url, LINK_JOB_LEASE, HOLDER, ttl)
+    while not acquired and wait:
+        time.sleep(max(1.0, ttl / 10))
+        acquired = db.acquire_lease(db_url, LINK_JOB_LEASE, HOLDER, ttl)
+    if not acquired:
+        yield False
+        return
+
+    with _renewing(db_url, LINK_JOB_LEASE, ttl):
+        while db.live_leases(db_url, SHARD_LEASE_PREFIX):
+            time.sleep(max(1.0, ttl / 10))
+        yield True
+
+
+@contextmanager
+def shard_lease(db_url: str, *, ttl: float) -> Iterator[None]:
+    """Hold this replica's shard lease for a sharded run, renewing it in the background.
+
+    Sharded runs on different replicas hold different leases and run side by side; they wait
+    while the link-job lease is held, e.g. by a targeted run that may touch any shard's rules.
+    The shard lease is taken before the job lease is checked, and ``job_lease`` checks in the
+    opposite order, so the two can never both proceed.
+    """
+    name = SHARD_LEASE_PREFIX + HOLDER
+    while True:
+        db.acquire_lease(db_url, name, HOLDER, ttl)
+        if LINK_JOB_LEASE not in db.live_leases(db_url, LINK_JOB_LEASE):
+            break
+        db.release_lease(db_url, name, HOLDER)
+        time.sleep(max(1.0, ttl / 10))
+    with _renewing(db_url, name, ttl):
+        yield
+
+
+@contextmanager
+def lease(db_url: str, name: str, *, ttl: float) -> Iterator[None]:
+    """Hold the named lease for the block, waiting until it is free; for short critical sections."""
+    while not db.acquire_lease(db_url, name, HOLDER, ttl):
+        time.sleep(1.0)
+    with _renewing(db_url, name, ttl):
+        yield
+
+
+def current_shard(db_url: str, *, ttl: float) -> Shard:
+    """This replica's shard among the replicas with a live heartbeat."""
+    db.heartbeat_replica(db_url, HOLDER)
+    live = db.live_replicas(db_url, ttl)
+    if HOLDER not in live:
+        live = sorted([*live, HOLDER])
+    return Shard(index=live.index(HOLDER), count=len(live))
+
+
+class ReplicaHeartbeat:
+    """Background heartbeat that keeps this replica counted in the shard membership."""
+
+    def __init__(self, db_url: str, *, ttl: float) -> None:
+        self._db_url = db_url
+        self._ttl = ttl
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        db.heartbeat_replica(self._db_url, HOLDER)
+        self._thread = threading.Thread(
+            target=_renew_every,
+            args=(self._ttl / 3, lambda: db.heartbeat_replica(self._db_url, HOLDER), threading.Event()),
+            name="replica-heartbeat",
+            daemon=True,
+        )
+        self._thread.start()
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import os
+import re
 from dataclasses import dataclass, field
 from functools import lru_cache
 
@@ -10,6 +11,61 @@ def _env(key: str, default: str = "") -> str:
     return (os.environ.get(key) or default).strip()
 
 
+def _env_bool(key: str, default: bool = False) -> bool:
+    value = _env(key)
+    if not value:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class ArrInstance:
+    """One Sonarr or Radarr server, from the ``SONARR_<N>_*`` / ``RADARR_<N>_*`` variables."""
+
+    index: int
+    url: str
+    api_path: str = "/api/v3"
+    api_key: str = ""
+    # Stripped from the library paths the instance reports to get a path under the media root.
+    root_path_prefix: str = "/"
+
+    @property
+    def api_base(self) -> str:
+        if not self.url:
+            return ""
+        path = self.api_path if self.api_path.startswith("/") else f"/{self.api_path}"
+        return f"{self.url.rstrip('/')}{path}"
+
+
+def _instances(service: str) -> tuple[ArrInstance, ...]:
+    """Every ``<service>_<N>_URL`` instance, ordered by N.
+
+    Instance 0 also reads the unnumbered ``<service>_URL``/``_API_PATH``/``_API_KEY``. An
+    instance's ``_ROOT_PATH_PREFIX`` defaults to ``<service>_ROOT_PATH_PREFIX``. With none
+    configured, an instance 0 without a URL is returned, whose requests fail until one is set.
+    """
+    pattern = re.compile(rf"{service}_(\d+)_URL")
+    numbers = sorted({0} | {int(m.group(1)) for m in map(pattern.fullmatch, os.environ) if m})
+    instances = []
+    for n in numbers:
+
+        def var(name: str, default: str = "") -> str:
+            return _env(f"{service}_{n}_{name}") or (_env(f"{service}_{name}") if n == 0 else "") or default
+
+        if var("URL"):
+            instances.append(
+                ArrInstance(
+                    index=n,
+                    url=var("URL"),
+                    api_path=var("API_PATH", "/api/v3"),
+                    api_key=var("API_KEY"),
+                    root_path_prefix=_env(f"{service}_{n}_ROOT_PATH_PREFIX")
+                    or _env(f"{service}_ROOT_PATH_PREFIX", "/"),
+                )
+            )
+    return tuple(instances) or (ArrInstance(index=0, url=""),)
+
+
 @dataclass(frozen=True)
 class Settings:
     database_url: str = field(default_factory=lambda: _env("DATABASE_URL", ""))
@@ -17,36 +73,64 @@ class Settings:
         default_factory=lambda: _env("MEDIA_ROOT") or _env("DOCKER_MEDIA_PATH") or _env("HOST_MEDIA_PATH", "")
     )
 
-    sonarr_url: str = field(default_factory=lambda: _env("SONARR_0_URL") or _env("SONARR_URL"))
-    sonarr_api_path: str = field(
-        default_factory=lambda: _env("SONARR_0_API_PATH") or _env("SONARR_API_PATH") or "/api/v3"
-    )
-    sonarr_api_key: str = field(default_factory=lambda: _env("SONARR_0_API_KEY") or _env("SONARR_API_KEY"))
-    sonarr_root_path_prefix: str = field(default_factory=lambda: _env("SONARR_ROOT_PATH_PREFIX", "/"))
+    # Several instances (e.g. a 4K or an anime server) are merged; lower numbers take precedence.
+    sonarr_instances: tuple[ArrInstance, ...] = field(default_factory=lambda: _instances("SONARR"))
+    radarr_instances: tuple[ArrInstance, ...] = field(default_factory=lambda: _instances("RADARR"))
 
-    radarr_url: str = field(default_factory=lambda: _env("RADARR_0_URL") or _env("RADARR_URL"))
-    radarr_api_path: str = field(
-        default_factory=lambda: _env("RADARR_0_API_PATH") or _env("RADARR_API_PATH") or "/api/v3"
-    )
-    radarr_api_key: str = field(default_factory=lambda: _env("RADARR_0_API_KEY") or _env("RADARR_API_KEY"))
+    plex_url: str = field(default_factory=lambda: _env("PLEX_URL"))
+    plex_api_key: str = field(default_factory=lambda: _env("PLEX_API_KEY"))
+    # The media root as Plex sees it, when Plex mounts it at another path.
+    plex_media_root: str = field(default_factory=lambda: _env("PLEX_MEDIA_ROOT"))
 
     scan_interval_minutes: int = field(
         default_factory=lambda: int(_env("PLEX_LINKER_SCAN_INTERVAL_MINUTES", "15"))
     )
+    # Scheduled runs skip unchanged rules; this often one rebuilds every rule (0 = never).
+    full_scan_interval_hours: float = field(
+        default_factory=lambda: float(_env("PLEX_LINKER_FULL_SCAN_INTERVAL_HOURS", "24"))
+    )
+    webhook_debounce_seconds: float = field(
+        default_factory=lambda: float(_env("PLEX_LINKER_WEBHOOK_DEBOUNCE_SECONDS", "10"))
+    )
+    watch_movies: bool = field(default_factory=lambda: _env_bool("PLEX_LINKER_WATCH_MOVIES"))
 
-    @property
-    def sonarr_api_base(self) -> str:
-        if not self.sonarr_url:
-            return ""
-        path = self.sonarr_api_path if self.sonarr_api_path.startswith("/") else f"/{self.sonarr_api_path}"
-        return f"{self.sonarr_url.rstrip('/')}{path}"
+    run_history_limit: int = field(default_factory=lambda: int(_env("PLEX_LINKER_RUN_HISTORY", "1000")))
+
+    lease_ttl_seconds: float = field(
+        default_factory=lambda: float(_env("PLEX_LINKER_LEASE_TTL_SECONDS", "120"))
+    )
+    shard_rules: bool = field(default_factory=lambda: _env_bool("PLEX_LINKER_SHARD_RULES"))
+
+    link_audit: bool = field(default_factory=lambda: _env_bool("PLEX_LINKER_LINK_AUDIT"))
+    link_workers: int = field(default_factory=lambda: int(_env("PLEX_LINKER_LINK_WORKERS", "4")))
+
+    http_rate_per_second: float = field(
+        default_factory=lambda: float(_env("PLEX_LINKER_HTTP_RATE_PER_SECOND", "10"))
+    )
+    http_burst: int = field(default_factory=lambda: int(_env("PLEX_LINKER_HTTP_BURST", "10")))
+    http_max_retries: int = field(default_factory=lambda: int(_env("PLEX_LINKER_HTTP_MAX_RETRIES", "4")))
+    http_backoff_seconds: float = field(
+        default_factory=lambda: float(_env("PLEX_LINKER_HTTP_BACKOFF_SECONDS", "0.5"))
+    )
+    catalog_max_age_minutes: int = field(
+        default_factory=lambda: int(_env("PLEX_LINKER_CATALOG_MAX_AGE_MINUTES", "360"))
+    )
+    stream_library: bool = field(
+        default_factory=lambda: _env_bool("PLEX_LINKER_STREAM_LIBRARY", default=True)
+    )
+    http_pool_size: int = field(default_factory=lambda: int(_env("PLEX_LINKER_HTTP_POOL_SIZE", "10")))
+
+    episode_cache_ttl_minutes: int = field(
+        default_factory=lambda: int(_env("PLEX_LINKER_EPISODE_CACHE_TTL_MINUTES", "0"))
+    )
+    episode_cache_max_series: int = field(
+        default_factory=lambda: int(_env("PLEX_LINKER_EPISODE_CACHE_MAX_SERIES", "500"))
+    )
 
     @property
-    def radarr_api_base(self) -> str:
-        if not self.radarr_url:
-            return ""
-        path = self.radarr_api_path if self.radarr_api_path.startswith("/") else f"/{self.radarr_api_path}"
-        return f"{self.radarr_url.rstrip('/')}{path}"
+    def media_root_ready(self) -> bool:
+        """MEDIA_ROOT is set and is a directory; without it a link job has nothing to do."""
+        return bool(self.media_root) and os.path.isdir(self.media_root)
 
 
 @lru_cache(maxsize=1)
@@ -0,0 +1,15 @@
+"""Shared pytest fixtures."""
+from __future__ import annotations
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def db_url(tmp_path, monkeypatch) -> str:
+    """A fresh SQLite database in place of the process-wide engine."""
+    monkeypatch.setattr(db, "_engine", None)
+    url = f"sqlite:///{tmp_path}/test.db"
+    assert db.init_db(url)
+    return url
@@ -1,28 +1,63 @@
-"""Database layer for link rules and settings. Supports SQLite and PostgreSQL via SQLAlchemy."""
+"""Database layer for link rules, link-job state and settings. Supports SQLite and PostgreSQL via SQLAlchemy."""
 from __future__ import annotations
 
+import functools
 import json
 import logging
 import os
-from typing import Any, Optional
+import time
+from typing import Any, Callable, Optional, TypeVar, cast
 
 from sqlalchemy import (
+    BigInteger,
+    Boolean,
     Column,
+    Float,
     Integer,
     MetaData,
     String,
     Table,
     Text,
     UniqueConstraint,
+    bindparam,
+    case,
     create_engine,
     delete,
+    exists,
+    func,
     insert,
+    inspect,
+    or_,
     select,
+    text,
+    tuple_,
+    update,
 )
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+import metrics
 
 log = logging.getLogger(__name__)
 
+_DB_QUERY_SECONDS = metrics.Histogram(
+    "plex_linker_db_query_seconds", "Duration of database calls by function", ("operation",)
+)
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def _timed(fn: _F) -> _F:
+    """Record the call's duration in ``plex_linker_db_query_seconds``."""
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with _DB_QUERY_SECONDS.time(operation=fn.__name__):
+            return fn(*args, **kwargs)
+
+    return cast(_F, wrapper)
+
+
 metadata = MetaData()
 
 link_rules = Table(
@@ -30,16 +65,111 @@ link_rules = Table(
     metadata,
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("movie_title", String, nullable=False),
-    Column("tmdb_id", Integer, nullable=False),
-    Column("show_name", String, nullable=False),
+    Column("tmdb_id", Integer, nullable=False, index=True),
+    Column("show_name", String, nullable=False, index=True),
     Column("episode", Integer),
     Column("season", String),
     Column("episode_id", Integer),
-    Column("series_id", Integer),
+    Column("series_id", Integer, index=True),
     Column("tvdb_id", Integer),
+    # The Sonarr instance that episode_id and series_id belong to (NULL: instance 0).
+    Column("sonarr_instance", Integer),
     UniqueConstraint("movie_title", "show_name"),
 )
 
+rule_state = Table(
+    "rule_state",
+    metadata,
+    Column("rule_id", Integer, primary_key=True),
+    Column("fingerprint", String, nullable=False),
+    Column("episode_title", String),
+    Column("updated_at", Float, nullable=False),
+)
+
+managed_links = Table(
+    "managed_links",
+    metadata,
+    Column("dst", String, primary_key=True),
+    Column("target", String, nullable=False),
+    Column("rule_id", Integer, index=True),
+    Column("series_id", Integer),
+    Column("movie_id", Integer),
+    Column("sonarr_instance", Integer),
+    Column("radarr_instance", Integer),
+    Column("target_inode", BigInteger),
+    Column("target_mtime", Float),
+    Column("updated_at", Float, nullable=False),
+)
+
+catalog_movies = Table(
+    "catalog_movies",
+    metadata,
+    Column("instance", Integer, primary_key=True),
+    Column("id", Integer, primary_key=True),
+    Column("tmdb_id", Integer),
+    Column("imdb_id", String),
+    Column("path", String),
+    Column("has_file", Boolean),
+    Column("movie_file_id", Integer),
+    Column("relative_path", String),
+    Column("quality", String),
+)
+
+catalog_series = Table(
+    "catalog_series",
+    metadata,
+    Column("instance", Integer, primary_key=True),
+    Column("id", Integer, primary_key=True),
+    Column("title", String),
+    Column("tvdb_id", Integer),
+    Column("path", String),
+    Column("series_type", String),
+)
+
+catalog_sync = Table(
+    "catalog_sync",
+    metadata,
+    Column("service", String, primary_key=True),
+    Column("instance", Integer, primary_key=True),
+    Column("full_at", Float, nullable=False),
+    Column("synced_at", Float, nullable=False),
+)
+
+job_leases = Table(
+    "job_leases",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("holder", String, nullable=False),
+    Column("expires_at", Float, nullable=False),
+    Column("heartbeat_at", Float, nullable=False),
+)
+
+runs = Table(
+    "runs",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("source", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("started_at", Float, nullable=False),
+    Column("finished_at", Float, nullable=False),
+    Column("phases", Text),
+    Column("api_calls", Integer),
+    Column("api_bytes", BigInteger),
+    Column("links_created", Integer),
+    Column("links_updated", Integer),
+    Column("links_unchanged", Integer),
+    Column("links_failed", Integer),
+    Column("rules", Text),
+    Column("error", Text),
+)
+
+replicas = Table(
+    "replicas",
+    metadata,
+    Column("holder", String, primary_key=True),
+    Column("heartbeat_at", Float, nullable=False),
+)
+
 settings_table = Table(
     "settings",
     metadata,
@@ -49,6 +179,13 @@ settings_table = Table(
 
 _engine: Optional[Engine] = None
 
+# Keeps IN (...) lists under SQLite's bound-parameter limit.
+_IN_CHUNK = 500
+
+
+def _chunks(values: list[Any]) -> list[list[Any]]:
+    return [values[i : i + _IN_CHUNK] for i in range(0, len(values), _IN_CHUNK)]
+
 
 def _normalize_url(db_url: str) -> str:
     """Rewrite postgresql:// to postgresql+pg8000:// so the pure-Python driver is used."""
@@ -71,10 +208,39 @@ def get_engine(db_url: str) -> Engine:
 
     _engine = create_engine(url, pool_pre_ping=True)
     metadata.create_all(_engine)
+    _upgrade_schema(_engine)
     log.info("Database initialized: %s", url.split("@")[-1] if "@" in url else url)
     return _engine
 
 
+def _upgrade_schema(engine: Engine) -> None:
+    """Add columns and indexes declared after a table was created; ``create_all`` skips existing tables.
+
+    The catalog snapshot is only a cache, so its tables are recreated instead when their columns
+    changed (e.g. a primary key grew), and the next run fetches the libraries in full.
+    """
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if missing and table.name.startswith("catalog_"):
+            log.info("Recreating catalog snapshot table %s", table.name)
+            table.drop(engine)
+            table.create(engine)
+        elif missing:
+            with engine.begin() as conn:
+                for column in missing:
+                    conn.execute(
+                        text(
+                            f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                            f"{preparer.format_column(column)} {column.type.compile(engine.dialect)}"
+                        )
+                    )
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
 def init_db(db_url: str) -> bool:
     """Ensure tables exist. Returns True when the engine is ready."""
     if not db_url:
@@ -90,15 +256,63 @@ def init_db(db_url: str) -> bool:
 # --- Link Rules ---
 
 
-def list_rules(db_url: str) -> list[dict[str, Any]]:
+# Sort key -> columns ordered by; the trailing id makes every key unique for keyset paging.
+RULE_SORTS = {
+    "movie_title": (link_rules.c.movie_title, link_rules.c.show_name, link_rules.c.id),
+    "show_name": (link_rules.c.show_name, link_rules.c.movie_title, link_rules.c.id),
+    "tmdb_id": (link_rules.c.tmdb_id, link_rules.c.id),
+    "id": (link_rules.c.id,),
+}
+
+_rule_linked = exists().where(managed_links.c.rule_id == link_rules.c.id)
+
+
+@_timed
+def list_rules(
+    db_url: str,
+    *,
+    limit: Optional[int] = None,
+    after: Optional[list[Any]] = None,
+    sort: str = "movie_title",
+    descending: bool = False,
+    movie: Optional[str] = None,
+    show: Optional[str] = None,
+    tmdb_id: Optional[int] = None,
+    linked: Optional[bool] = None,
+) -> list[dict[str, Any]]:
+    """Link rules with a ``linked`` flag (the rule has a managed link), filtered and sorted.
+
+    ``movie``/``show`` match case-insensitive substrings. For keyset paging pass ``rule_sort_key``
+    of the last row of a page as ``after`` to get the rows that follow it.
+    """
+    columns = RULE_SORTS[sort]
+    query = select(link_rules, _rule_linked.label("linked"))
+    if movie:
+        query = query.where(link_rules.c.movie_title.icontains(movie, autoescape=True))
+    if show:
+        query = query.where(link_rules.c.show_name.icontains(show, autoescape=True))
+    if tmdb_id is not None:
+        query = query.where(link_rules.c.tmdb_id == tmdb_id)
+    if linked is not None:
+        query = query.where(_rule_linked if linked else ~_rule_linked)
+    if after is not None:
+        key = tuple_(*columns)
+        query = query.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    query = query.order_by(*(c.desc() if descending else c for c in columns))
+    if limit is not None:
+        query = query.limit(limit)
     engine = get_engine(db_url)
     with engine.connect() as conn:
-        rows = conn.execute(
-            select(link_rules).order_by(link_rules.c.movie_title, link_rules.c.show_name)
-        ).mappings().all()
+        rows = conn.execute(query).mappings().all()
     return [dict(r) for r in rows]
 
 
+def rule_sort_key(rule: dict[str, Any], sort: str) -> list[Any]:
+    """Values of a ``list_rules`` row for the ``sort`` columns, usable as ``after``."""
+    return [rule[c.name] for c in RULE_SORTS[sort]]
+
+
+@_timed
 def add_rule(
     db_url: str,
     *,
@@ -110,6 +324,7 @@ def add_rule(
     episode_id: Optional[int] = None,
     series_id: Optional[int] = None,
     tvdb_id: Optional[int] = None,
+    sonarr_instance: Optional[int] = None,
 ) -> Optional[int]:
     engine = get_engine(db_url)
     with engine.begin() as conn:
@@ -123,18 +338,77 @@ def add_rule(
                 episode_id=episode_id,
                 series_id=series_id,
                 tvdb_id=tvdb_id,
+                sonarr_instance=sonarr_instance,
             )
         )
         return result.inserted_primary_key[0] if result.inserted_primary_key else None
 
 
+def _dialect_insert(engine: Engine, table: Table) -> Any:
+    """An INSERT supporting ``on_conflict_do_update`` on the engine's SQLite or PostgreSQL dialect."""
+    # The PostgreSQL dialect module is slow to import and only upserts need it.
+    from sqlalchemy.dialects import postgresql, sqlite
+
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def _upsert(conn: Any, table: Table, rows: list[dict[str, Any]]) -> None:
+    """Insert rows, overwriting the other columns of rows whose primary key already exists.
+
+    Unlike delete-then-insert, this cannot fail when a concurrent transaction inserted the same
+    key after our delete ran (PostgreSQL's READ COMMITTED); the later write wins instead.
+    """
+    stmt = _dialect_insert(conn.engine, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={c.name: stmt.excluded[c.name] for c in table.columns if not c.primary_key},
+    )
+    conn.execute(stmt, rows)
+
+
+@_timed
+def upsert_rules(db_url: str, rules: list[dict[str, Any]]) -> None:
+    """Insert rules in one statement, updating the existing rule with the same movie and show.
+
+    Every dict needs all ``link_rules`` columns but ``id``, and no two may share a movie and show.
+    Stored Sonarr IDs are kept when the incoming rule has none; the stored instance is kept with
+    the stored series ID.
+    """
+    if not rules:
+        return
+    engine = get_engine(db_url)
+    stmt = _dialect_insert(engine, link_rules)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[link_rules.c.movie_title, link_rules.c.show_name],
+        set_={
+            "tmdb_id": stmt.excluded.tmdb_id,
+            "episode": stmt.excluded.episode,
+            "season": stmt.excluded.season,
+            **{
+                name: func.coalesce(stmt.excluded[name], link_rules.c[name])
+                for name in ("episode_id", "series_id", "tvdb_id")
+            },
+            "sonarr_instance": case(
+                (stmt.excluded.series_id.is_(None), link_rules.c.sonarr_instance),
+                else_=stmt.excluded.sonarr_instance,
+            ),
+        },
+    )
+    with engine.begin() as conn:
+        conn.execute(stmt, rules)
+
+
+@_timed
 def delete_rule(db_url: str, rule_id: int) -> bool:
     engine = get_engine(db_url)
     with engine.begin() as conn:
+        conn.execute(delete(rule_state).where(rule_state.c.rule_id == rule_id))
         result = conn.execute(delete(link_rules).where(link_rules.c.id == rule_id))
         return result.rowcount > 0
 
 
+@_timed
 def get_movies_dict(db_url: str) -> dict[str, Any]:
     """Return link rules in the dict shape the linker expects:
     { movie_title: { "Movie DB ID": tmdb_id, "Shows": { show_name: {...} } } }
@@ -143,6 +417,7 @@ def get_movies_dict(db_url: str) -> dict[str, Any]:
     with engine.connect() as conn:
         rows = conn.execute(
             select(
+                link_rules.c.id,
                 link_rules.c.movie_title,
                 link_rules.c.tmdb_id,
                 link_rules.c.show_name,
@@ -151,6 +426,7 @@ def get_movies_dict(db_url: str) -> dict[str, Any]:
                 link_rules.c.episode_id,
                 link_rules.c.series_id,
                 link_rules.c.tvdb_id,
+                link_rules.c.sonarr_instance,
             ).order_by(link_rules.c.movie_title, link_rules.c.show_name)
         ).mappings().all()
 
@@ -160,19 +436,316 @@ def get_movies_dict(db_url: str) -> dict[str, Any]:
         if mt not in out:
             out[mt] = {"Movie DB ID": row["tmdb_id"], "Shows": {}}
         show_data = {
+            "Rule ID": row["id"],
             "Episode": row["episode"],
             "Season": row["season"],
             "Episode ID": row["episode_id"],
             "seriesId": row["series_id"],
             "tvdbId": row["tvdb_id"],
+            "sonarrInstance": row["sonarr_instance"],
         }
         out[mt]["Shows"][row["show_name"]] = {k: v for k, v in show_data.items() if v is not None}
     return out
 
 
+@_timed
+def save_rule_ids(db_url: str, rows: list[dict[str, Any]]) -> None:
+    """Store the Sonarr IDs resolved for rules.
+
+    One ``{rule_id, series_id, tvdb_id, episode_id, sonarr_instance}`` dict per rule.
+    """
+    if not rows:
+        return
+    # Bind names must differ from the column names an UPDATE sets.
+    params = [{f"b_{k}": v for k, v in row.items()} for row in rows]
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        conn.execute(
+            update(link_rules)
+            .where(link_rules.c.id == bindparam("b_rule_id"))
+            .values(
+                series_id=bindparam("b_series_id"),
+                tvdb_id=bindparam("b_tvdb_id"),
+                episode_id=bindparam("b_episode_id"),
+                sonarr_instance=bindparam("b_sonarr_instance"),
+            ),
+            params,
+        )
+
+
+# --- Rule State ---
+
+
+@_timed
+def get_rule_states(db_url: str) -> dict[int, dict[str, Any]]:
+    """Fingerprint of each rule's inputs as of the last run that linked it, keyed by rule id."""
+    engine = get_engine(db_url)
+    with engine.connect() as conn:
+        rows = conn.execute(select(rule_state)).mappings().all()
+    return {r["rule_id"]: dict(r) for r in rows}
+
+
+@_timed
+def save_rule_states(db_url: str, states: list[dict[str, Any]]) -> None:
+    if not states:
+        return
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        for chunk in _chunks([s["rule_id"] for s in states]):
+            conn.execute(delete(rule_state).where(rule_state.c.rule_id.in_(chunk)))
+        conn.execute(insert(rule_state), states)
+
+
+# --- Managed Links ---
+
+
+@_timed
+def list_managed_links(db_url: str) -> list[dict[str, Any]]:
+    """Every symlink the linker has created and still owns."""
+    engine = get_engine(db_url)
+    with engine.connect() as conn:
+        rows = conn.execute(select(managed_links)).mappings().all()
+    return [dict(r) for r in rows]
+
+
+@_timed
+def save_managed_links(db_url: str, links: list[dict[str, Any]]) -> None:
+    """Record links created or confirmed this run, replacing older rows for the same rules or paths."""
+    if not links:
+        return
+    dsts = [link["dst"] for link in links]
+    rule_ids = [link["rule_id"] for link in links if link.get("rule_id") is not None]
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        for chunk in _chunks(dsts):
+            conn.execute(delete(managed_links).where(managed_links.c.dst.in_(chunk)))
+        for chunk in _chunks(rule_ids):
+            conn.execute(delete(managed_links).where(managed_links.c.rule_id.in_(chunk)))
+        conn.execute(insert(managed_links), links)
+
+
+@_timed
+def delete_managed_links(db_url: str, dsts: list[str]) -> None:
+    if not dsts:
+        return
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        for chunk in _chunks(dsts):
+            conn.execute(delete(managed_links).where(managed_links.c.dst.in_(chunk)))
+
+
+# --- Catalog snapshot ---
+
+_CATALOG_TABLES = {"radarr": catalog_movies, "sonarr": catalog_series}
+
+
+@_timed
+def list_catalog(db_url: str, service: str, instance: int) -> list[dict[str, Any]]:
+    """Snapshot rows of one ``radarr`` (movies) or ``sonarr`` (series) instance, ordered by *arr ID."""
+    table = _CATALOG_TABLES[service]
+    engine = get_engine(db_url)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(table).where(table.c.instance == instance).order_by(table.c.id)
+        ).mappings().all()
+    return [dict(r) for r in rows]
+
+
+@_timed
+def replace_catalog(
+    db_url: str, service: str, instance: int, rows: list[dict[str, Any]], synced_at: float
+) -> None:
+    """Replace an instance's whole snapshot after a full library fetch."""
+    table = _CATALOG_TABLES[service]
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        conn.execute(delete(table).where(table.c.instance == instance))
+        if rows:
+            _upsert(conn, table, rows)
+        _set_catalog_sync(conn, service, instance, full_at=synced_at, synced_at=synced_at)
+
+
+@_timed
+def update_catalog(
+    db_url: str,
+    service: str,
+    instance: int,
+    rows: list[dict[str, Any]],
+    deleted_ids: list[int],
+    synced_at: Optional[float] = None,
+) -> None:
+    """Upsert changed snapshot rows and drop deleted ones; with ``synced_at``, record the sync."""
+    table = _CATALOG_TABLES[service]
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        for chunk in _chunks(deleted_ids):
+            conn.execute(delete(table).where(table.c.instance == instance, table.c.id.in_(chunk)))
+        if rows:
+            _upsert(conn, table, rows)
+        if synced_at is not None:
+            full_at = conn.execute(
+                select(catalog_sync.c.full_at).where(
+                    catalog_sync.c.service == service, catalog_sync.c.instance == instance
+                )
+            ).scalar()
+            _set_catalog_sync(conn, service, instance, full_at=full_at or 0.0, synced_at=synced_at)
+
+
+def _set_catalog_sync(conn: Any, service: str, instance: int, *, full_at: float, synced_at: float) -> None:
+    _upsert(
+        conn,
+        catalog_sync,
+        [{"service": service, "instance": instance, "full_at": full_at, "synced_at": synced_at}],
+    )
+
+
+@_timed
+def get_catalog_sync(db_url: str, service: str, instance: int) -> Optional[dict[str, Any]]:
+    """When an instance's snapshot was last fetched in full (``full_at``) and synced (``synced_at``)."""
+    engine = get_engine(db_url)
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(catalog_sync).where(
+                catalog_sync.c.service == service, catalog_sync.c.instance == instance
+            )
+        ).mappings().fetchone()
+    return dict(row) if row else None
+
+
+# --- Run history ---
+
+_RUN_JSON_COLUMNS = ("phases", "rules")
+
+
+def _run_row(row: Any) -> dict[str, Any]:
+    out = dict(row)
+    for key in _RUN_JSON_COLUMNS:
+        out[key] = json.loads(out[key]) if out[key] else {}
+    return out
+
+
+@_timed
+def add_run(db_url: str, run: dict[str, Any]) -> Optional[int]:
+    """Record a finished link-job run. ``phases`` and ``rules`` are stored as JSON."""
+    values = {**run, **{k: json.dumps(run.get(k) or {}) for k in _RUN_JSON_COLUMNS}}
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        result = conn.execute(insert(runs).values(**values))
+        return result.inserted_primary_key[0] if result.inserted_primary_key else None
+
+
+@_timed
+def list_runs(db_url: str, limit: int = 50) -> list[dict[str, Any]]:
+    """Most recent runs first."""
+    engine = get_engine(db_url)
+    with engine.connect() as conn:
+        rows = conn.execute(select(runs).order_by(runs.c.id.desc()).limit(limit)).mappings().all()
+    return [_run_row(r) for r in rows]
+
+
+@_timed
+def get_run(db_url: str, run_id: int) -> Optional[dict[str, Any]]:
+    engine = get_engine(db_url)
+    with engine.connect() as conn:
+        row = conn.execute(select(runs).where(runs.c.id == run_id)).mappings().fetchone()
+    return _run_row(row) if row else None
+
+
+@_timed
+def prune_runs(db_url: str, keep: int) -> None:
+    """Delete all but the ``keep`` most recent runs. ``keep`` <= 0 keeps everything."""
+    if keep <= 0:
+        return
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        cutoff = conn.execute(
+            select(runs.c.id).order_by(runs.c.id.desc()).offset(keep).limit(1)
+        ).scalar()
+        if cutoff is not None:
+            conn.execute(delete(runs).where(runs.c.id <= cutoff))
+
+
+# --- Leases and replicas ---
+
+
+@_timed
+def acquire_lease(db_url: str, name: str, holder: str, ttl: float) -> bool:
+    """Take or renew the named lease. Succeeds when it is free, expired, or already ours."""
+    now = time.time()
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(job_leases)
+            .where(job_leases.c.name == name)
+            .where(or_(job_leases.c.holder == holder, job_leases.c.expires_at < now))
+            .values(holder=holder, expires_at=now + ttl, heartbeat_at=now)
+        )
+        if result.rowcount:
+            return True
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                insert(job_leases).values(
+                    name=name, holder=holder, expires_at=now + ttl, heartbeat_at=now
+                )
+            )
+        return True
+    except IntegrityError:
+        return False
+
+
+@_timed
+def release_lease(db_url: str, name: str, holder: str) -> None:
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        conn.execute(
+            delete(job_leases).where(job_leases.c.name == name, job_leases.c.holder == holder)
+        )
+
+
+@_timed
+def live_leases(db_url: str, prefix: str) -> list[str]:
+    """Names of the unexpired leases whose name starts with ``prefix``."""
+    engine = get_engine(db_url)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(job_leases.c.name)
+            .where(job_leases.c.name.startswith(prefix, autoescape=True))
+            .where(job_leases.c.expires_at >= time.time())
+        ).all()
+    return [r[0] for r in rows]
+
+
+@_timed
+def heartbeat_replica(db_url: str, holder: str) -> None:
+    now = time.time()
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(replicas).where(replicas.c.holder == holder).values(heartbeat_at=now)
+        )
+        if not result.rowcount:
+            conn.execute(insert(replicas).values(holder=holder, heartbeat_at=now))
+
+
+@_timed
+def live_replicas(db_url: str, ttl: float) -> list[str]:
+    """Holders that sent a heartbeat within ``ttl`` seconds, in a stable order."""
+    engine = get_engine(db_url)
+    with engine.begin() as conn:
+        conn.execute(delete(replicas).where(replicas.c.heartbeat_at < time.time() - 10 * ttl))
+        rows = conn.execute(
+            select(replicas.c.holder)
+            .where(replicas.c.heartbeat_at >= time.time() - ttl)
+            .order_by(replicas.c.holder)
+        ).all()
+    return [r[0] for r in rows]
+
+
 # --- Settings ---
 
 
+@_timed
 def get_setting(db_url: str, key: str) -> Any:
     engine = get_engine(db_url)
     with engine.connect() as conn:
@@ -187,6 +760,7 @@ def get_setting(db_url: str, key: str) -> Any:
         return row[0]
 
 
+@_timed
 def set_setting(db_url: str, key: str, value: Any) -> None:
     v = json.dumps(value) if isinstance(value, (list, dict)) else str(value)
     engine = get_engine(db_url)
@@ -1,30 +1,152 @@
 """Core link job: match movies (Radarr) to show specials (Sonarr) and create symlinks."""
 from __future__ import annotations
 
+import hashlib
 import logging
 import os
+import posixpath
 import re
+import stat
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
 from pathlib import Path
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Iterator, NamedTuple, Optional, Union
 
+import cluster
 import db
-from api_clients import RadarrClient, SonarrClient
+import metrics
 from config import Settings
 
+# catalog and api_clients pull in requests; they are imported where a run first needs them, so a
+# one-shot run with no rules never pays for it.
+if TYPE_CHECKING:
+    import catalog
+    from api_clients import HttpPolicy, PlexClient, RadarrClient, SonarrClient
+    from catalog import EpisodeCache, MovieRecord, SeriesRecord
+
 log = logging.getLogger(__name__)
 
+_PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+_RUNS = metrics.Counter(
+    "plex_linker_runs_total", "Link-job runs by result (completed, failed, skipped)", ("result",)
+)
+_RUN_SECONDS = metrics.Histogram(
+    "plex_linker_run_duration_seconds", "Duration of completed link-job runs", buckets=_PHASE_BUCKETS
+)
+_LAST_SUCCESS = metrics.Gauge(
+    "plex_linker_last_success_timestamp_seconds", "Unix time the last link-job run completed"
+)
+_PHASE_SECONDS = metrics.Histogram(
+    "plex_linker_run_phase_seconds", "Duration of each link-job phase", ("phase",), buckets=_PHASE_BUCKETS
+)
+_RULES = metrics.Counter(
+    "plex_linker_rules_total", "Show rules per run by result: linked, failed or the reason skipped", ("result",)
+)
+_SYMLINKS = metrics.Counter(
+    "plex_linker_symlinks_total", "Symlink writes by outcome (created, updated, unchanged, failed)", ("outcome",)
+)
+_AUDIT_SCANNED = metrics.Counter(
+    "plex_linker_audit_entries_scanned_total", "Directory entries examined by audit walks of the media root"
+)
+_AUDIT_REMOVED = metrics.Counter(
+    "plex_linker_audit_links_removed_total", "Broken symlinks removed by audit walks of the media root"
+)
+
+_shared_episode_cache: Optional[EpisodeCache] = None
+
+
+def remove_broken_symlinks(root: str) -> list[Path]:
+    """Audit mode: walk root and unlink any symlinks whose target no longer exists.
+
+    Uses ``os.scandir`` so the file type comes from the directory entry and only symlinks cost
+    an extra stat. Returns the removed paths.
+    """
+    removed: list[Path] = []
+    scanned = 0
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                scanned += 1
+                if entry.is_symlink():
+                    if os.path.exists(entry.path):
+                        continue
+                    try:
+                        os.unlink(entry.path)
+                        removed.append(Path(entry.path))
+                        log.debug("Removed broken symlink: %s", entry.path)
+                    except OSError:
+                        pass
+                elif entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    _AUDIT_SCANNED.inc(scanned)
+    _AUDIT_REMOVED.inc(len(removed))
+    return removed
+
+
+def _unlink_managed(row: dict[str, Any]) -> bool:
+    """Remove a registered link, but only if it is still the symlink the linker created."""
+    try:
+        if os.readlink(row["dst"]) != row["target"]:
+            return False
+        os.unlink(row["dst"])
+    except OSError:
+        return False
+    log.info("Removed managed symlink: %s", row["dst"])
+    return True
+
 
-def remove_broken_symlinks(root: str) -> None:
-    """Walk root and unlink any symlinks whose target no longer exists."""
-    for dirpath, _, filenames in os.walk(root, topdown=False):
-        for name in filenames:
-            p = Path(dirpath) / name
-            if p.is_symlink() and not p.exists():
-                try:
-                    p.unlink()
-                    log.debug("Removed broken symlink: %s", p)
-                except OSError:
-                    pass
+def cleanup_managed_links(
+    db_url: str,
+    rule_ids: set[int],
+    all_rule_ids: Optional[set[int]] = None,
+    *,
+    dry_run: bool = False,
+) -> tuple[dict[int, dict[str, Any]], set[tuple[int, int]]]:
+    """Check only the links in the managed-links registry instead of walking the media root.
+
+    Broken links and links whose rule was deleted are unlinked; rows for links that are gone or
+    were replaced by something else are dropped. When sharding, ``rule_ids`` is this replica's
+    share and rows belonging to other existing rules (``all_rule_ids``) are left alone. Returns
+    the surviving rows by rule id and the (Sonarr instance, series id) pairs that lost a link.
+    With ``dry_run`` the links that would be removed are only logged.
+    """
+    kept: dict[int, dict[str, Any]] = {}
+    dropped: list[str] = []
+    series_keys: set[tuple[int, int]] = set()
+    for row in db.list_managed_links(db_url):
+        if all_rule_ids is not None and row["rule_id"] not in rule_ids and row["rule_id"] in all_rule_ids:
+            continue
+        try:
+            target = os.readlink(row["dst"])
+        except OSError:
+            dropped.append(row["dst"])
+            continue
+        if target != row["target"]:
+            dropped.append(row["dst"])
+            continue
+        if row["rule_id"] in rule_ids and os.path.exists(row["dst"]):
+            kept[row["rule_id"]] = row
+            continue
+        if dry_run:
+            log.info("Would remove managed symlink: %s", row["dst"])
+        elif _unlink_managed(row):
+            dropped.append(row["dst"])
+            if row["series_id"]:
+                series_keys.add((row["sonarr_instance"] or 0, row["series_id"]))
+    if not dry_run:
+        db.delete_managed_links(db_url, dropped)
+    return kept, series_keys
 
 
 def _sanitize_path(s: str) -> str:
@@ -32,22 +154,17 @@ def _sanitize_path(s: str) -> str:
     return s.replace("..", ".").replace(":", "-").lstrip("/")
 
 
-def _find_radarr_movie(tmdb_id: int, radarr_movies: list[dict]) -> Optional[dict]:
-    for movie in radarr_movies:
-        if movie.get("tmdbId") == tmdb_id:
-            return movie
-    return None
-
+def _extract_movie_file_info(movie: MovieRecord, radarr: RadarrClient) -> tuple[str, str, str]:
+    """Return (file_path, quality_name, extension) from a Radarr catalog record.
 
-def _extract_movie_file_info(radarr_data: dict) -> tuple[str, str, str]:
-    """Return (absolute_file_path, quality_name, extension) from a Radarr movie entry."""
-    movie_file = radarr_data.get("movieFile")
-    if not movie_file:
+    The path is the one Radarr reports with the instance's root path prefix stripped.
+    """
+    if not movie.relative_path:
         return "", "", ".mkv"
 
-    movie_path = radarr_data.get("path", "")
-    relative = movie_file.get("relativePath", "")
-    quality_name = ((movie_file.get("quality") or {}).get("quality") or {}).get("name", "")
+    movie_path = radarr.media_path(movie.path)
+    relative = movie.relative_path
+    quality_name = movie.quality
     extension = (
         re.sub(re.escape(quality_name), "", relative.rsplit(" ", 1)[-1])
         if quality_name
@@ -57,15 +174,31 @@ def _extract_movie_file_info(radarr_data: dict) -> tuple[str, str, str]:
     return absolute, quality_name, extension
 
 
-def _find_special_episode(sonarr: SonarrClient, series_id: int, target_episode: int) -> Optional[dict]:
-    """Find a Season 0 episode matching target_episode for the given series."""
-    for ep in sonarr.get_episodes(series_id):
-        try:
-            if int(ep.get("seasonNumber", -1)) == 0 and int(ep.get("episodeNumber", -1)) == target_episode:
-                return ep
-        except (TypeError, ValueError):
-            continue
-    return None
+def _http_policy(settings: Settings) -> HttpPolicy:
+    from api_clients import HttpPolicy
+
+    return HttpPolicy(
+        rate=settings.http_rate_per_second,
+        burst=settings.http_burst,
+        max_retries=settings.http_max_retries,
+        backoff=settings.http_backoff_seconds,
+        pool_size=max(settings.http_pool_size, settings.link_workers),
+    )
+
+
+def _episode_cache(settings: Settings) -> EpisodeCache:
+    """Per-run episode cache, or the process-wide TTL cache when one is configured."""
+    global _shared_episode_cache
+    from catalog import EpisodeCache
+
+    if settings.episode_cache_ttl_minutes <= 0:
+        return EpisodeCache()
+    if _shared_episode_cache is None:
+        _shared_episode_cache = EpisodeCache(
+            ttl_seconds=settings.episode_cache_ttl_minutes * 60,
+            max_series=settings.episode_cache_max_series,
+        )
+    return _shared_episode_cache
 
 
 def _pad_episode(episode: Any, padding: int) -> str:
@@ -76,162 +209,882 @@ def _pad_episode(episode: Any, padding: int) -> str:
     return "00"
 
 
-def _create_relative_symlink(src: Path, dst: Path) -> bool:
-    """Create a symlink at dst pointing to src using a relative target."""
-    if not src.is_file():
-        log.warning("Source file not found: %s", src)
+class LinkOutcome(str, Enum):
+    """What applying a planned link did on disk (or would do, in a dry run)."""
+
+    CREATED = "created"
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+    FAILED = "failed"
+
+
+class LinkOp(NamedTuple):
+    """One symlink the plan stage wants: ``dst`` pointing at ``src``, for one show rule."""
+
+    rule_id: Optional[int]
+    src: Path
+    dst: Path
+    series_id: int
+    movie_id: int
+    sonarr_instance: int
+    radarr_instance: int
+    fingerprint: str
+    episode_title: str
+
+    @property
+    def target(self) -> str:
+        """The relative symlink target, as stored in ``managed_links``."""
+        return os.path.relpath(self.src, self.dst.parent)
+
+
+class _StatCache:
+    """Per-run ``os.stat`` results for link sources; the shows of one movie rule share its file."""
+
+    def __init__(self) -> None:
+        self._stats: dict[Path, Optional[os.stat_result]] = {}
+        self._lock = threading.Lock()
+
+    def stat(self, path: Path) -> Optional[os.stat_result]:
+        with self._lock:
+            if path in self._stats:
+                return self._stats[path]
+        try:
+            result: Optional[os.stat_result] = os.stat(path)
+        except OSError:
+            result = None
+        with self._lock:
+            self._stats[path] = result
+        return result
+
+
+def _read_link(path: Path) -> Optional[str]:
+    """Target of a symlink; None when nothing is there, "" when it is not a symlink."""
+    try:
+        return os.readlink(path)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        return ""
+
+
+def _replace_symlink(target: str, dst: Path, current: Optional[str]) -> LinkOutcome:
+    """Point dst at target through a temporary link renamed over it, so dst is never missing."""
+    tmp = dst.parent / f".plex-linker-{uuid.uuid4().hex}.tmp"
+    try:
+        os.symlink(target, tmp)
+        os.replace(tmp, dst)
+    except OSError:
+        log.exception("Failed to create symlink %s", dst)
+        tmp.unlink(missing_ok=True)
+        return LinkOutcome.FAILED
+
+    log.info("Symlink: %s -> %s", dst, target)
+    return LinkOutcome.CREATED if current is None else LinkOutcome.UPDATED
+
+
+def _apply_dir(
+    directory: Path, ops: list[LinkOp], sources: _StatCache, *, dry_run: bool = False
+) -> list[LinkOutcome]:
+    """Apply the planned links of one destination directory, writing only what must change.
+
+    The directory is listed once, so links that do not exist yet cost no ``readlink``, and it is
+    created at most once. An existing link with the right target is left alone. With ``dry_run``
+    nothing is written; the outcomes say what would have happened.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            names: Optional[set[str]] = {entry.name for entry in entries}
+    except OSError:
+        names = None
+    ready = names is not None
+    outcomes: list[LinkOutcome] = []
+    for op in ops:
+        source = sources.stat(op.src)
+        if source is None or not stat.S_ISREG(source.st_mode):
+            log.warning("Source file not found: %s", op.src)
+            outcomes.append(LinkOutcome.FAILED)
+            continue
+        current = _read_link(op.dst) if names is not None and op.dst.name in names else None
+        if current == op.target:
+            outcomes.append(LinkOutcome.UNCHANGED)
+            continue
+        if dry_run:
+            outcomes.append(LinkOutcome.CREATED if current is None else LinkOutcome.UPDATED)
+            continue
+        if not ready:
+            try:
+                directory.mkdir(parents=True, exist_ok=True)
+            except OSError:
+                log.exception("Failed to create directory %s", directory)
+                outcomes.append(LinkOutcome.FAILED)
+                continue
+            ready = True
+        outcomes.append(_replace_symlink(op.target, op.dst, current))
+    return outcomes
+
+
+def _apply_plan(
+    plan: list[LinkOp], sources: _StatCache, *, workers: int, dry_run: bool = False
+) -> list[tuple[LinkOp, LinkOutcome]]:
+    """Apply a plan grouped by destination directory, one worker per directory at a time."""
+    by_dir: dict[Path, list[LinkOp]] = {}
+    for op in plan:
+        by_dir.setdefault(op.dst.parent, []).append(op)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="apply") as pool:
+        outcomes = pool.map(
+            lambda item: _apply_dir(item[0], item[1], sources, dry_run=dry_run), by_dir.items()
+        )
+        return [pair for ops, done in zip(by_dir.values(), outcomes) for pair in zip(ops, done)]
+
+
+@dataclass(frozen=True)
+class LinkScope:
+    """Which rules a run covers.
+
+    The default scope covers every rule and skips those whose inputs are unchanged. ``full``
+    rebuilds every rule. Rules matching ``rule_ids``/``tmdb_ids``/``series_ids`` are always
+    rebuilt, and with ``targeted`` set the run covers only those rules (e.g. after a webhook).
+    """
+
+    full: bool = False
+    targeted: bool = False
+    rule_ids: frozenset[int] = frozenset()
+    tmdb_ids: frozenset[int] = frozenset()
+    series_ids: frozenset[int] = frozenset()
+
+    def forces(self, rule_id: Optional[int], tmdb_id: int, series_id: int) -> bool:
+        return (
+            self.full
+            or rule_id in self.rule_ids
+            or tmdb_id in self.tmdb_ids
+            or series_id in self.series_ids
+        )
+
+    def includes(self, rule_id: Optional[int], tmdb_id: int, series_id: int) -> bool:
+        return not self.targeted or self.forces(rule_id, tmdb_id, series_id)
+
+    def merge(self, other: LinkScope) -> LinkScope:
+        """A scope covering everything either scope covers."""
+        return LinkScope(
+            full=self.full or other.full,
+            targeted=self.targeted and other.targeted,
+            rule_ids=self.rule_ids | other.rule_ids,
+            tmdb_ids=self.tmdb_ids | other.tmdb_ids,
+            series_ids=self.series_ids | other.series_ids,
+        )
+
+
+@dataclass
+class _RunStats:
+    """Timings and counts for one run, saved to the ``runs`` table when it ends."""
+
+    source: str
+    started_at: float = field(default_factory=time.time)
+    phases: dict[str, float] = field(default_factory=dict)
+    clients: list[Union[SonarrClient, RadarrClient, PlexClient]] = field(default_factory=list)
+    outcomes: Counter[LinkOutcome] = field(default_factory=Counter)
+    rule_results: Counter[str] = field(default_factory=Counter)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        _PHASE_SECONDS.observe(seconds, phase=name)
+
+
+@dataclass
+class _LinkRun:
+    """State shared by every worker during one link-job run."""
+
+    settings: Settings
+    media_root: str
+    sonarrs: dict[int, SonarrClient]
+    radarrs: dict[int, RadarrClient]
+    radarr_catalog: catalog.RadarrCatalog
+    sonarr_index: catalog.SonarrIndex
+    episode_cache: EpisodeCache
+    plan: list[LinkOp] = field(default_factory=list)
+    # (instance, *arr ID) pairs to rescan.
+    changed_series: set[tuple[int, int]] = field(default_factory=set)
+    changed_movies: set[tuple[int, int]] = field(default_factory=set)
+    changed_dirs: set[Path] = field(default_factory=set)
+    outcomes: Counter[LinkOutcome] = field(default_factory=Counter)
+    managed: dict[int, dict[str, Any]] = field(default_factory=dict)
+    links: list[dict[str, Any]] = field(default_factory=list)
+    scope: LinkScope = LinkScope()
+    rule_states: dict[int, dict[str, Any]] = field(default_factory=dict)
+    new_states: list[dict[str, Any]] = field(default_factory=list)
+    resolved_ids: list[dict[str, Any]] = field(default_factory=list)
+    rule_results: Counter[str] = field(default_factory=Counter)
+    resolve_seconds: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _tally(run: _LinkRun, result: str, rules: int = 1) -> None:
+    """Count show rules by result for the run summary and ``plex_linker_rules_total``."""
+    with run.lock:
+        run.rule_results[result] += rules
+
+
+def _series_dir(run: _LinkRun, series: SeriesRecord) -> Path:
+    """Absolute directory of a Sonarr series under the media root."""
+    show_path = run.sonarrs[series.instance].media_path(series.path)
+    return Path(run.media_root) / _sanitize_path(show_path)
+
+
+def _fingerprint(
+    movie: MovieRecord, series: SeriesRecord, show_name: str, show_rule: dict, episode_title: str
+) -> str:
+    """Hash of everything that decides a rule's link: Radarr file, Sonarr series, rule, episode title."""
+    parts = (
+        movie.movie_file_id,
+        movie.relative_path,
+        movie.quality,
+        movie.path,
+        series.id,
+        series.path,
+        series.title,
+        series.series_type,
+        show_name,
+        show_rule.get("Episode"),
+        show_rule.get("Season"),
+        episode_title,
+    )
+    return hashlib.sha1("\0".join(map(str, parts)).encode()).hexdigest()
+
+
+def _is_unchanged(
+    run: _LinkRun, movie: MovieRecord, series: SeriesRecord, show_name: str, show_rule: dict
+) -> bool:
+    """True when the rule's link exists and none of its inputs changed since it was made.
+
+    The episode title is taken from the stored state, so an unchanged rule needs no episode fetch.
+    """
+    rule_id = show_rule.get("Rule ID")
+    state = run.rule_states.get(rule_id)
+    if run.scope.forces(rule_id, movie.tmdb_id, series.id) or not state or rule_id not in run.managed:
         return False
+    return state["fingerprint"] == _fingerprint(
+        movie, series, show_name, show_rule, state["episode_title"] or ""
+    )
 
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    rel_target = os.path.relpath(src, dst.parent)
 
-    if dst.exists() or dst.is_symlink():
-        dst.unlink()
+def _register_link(run: _LinkRun, op: LinkOp, sources: _StatCache) -> bool:
+    """Queue a managed-links row for an applied link and drop the rule's previous link if it moved.
 
-    os.symlink(rel_target, dst)
-    log.info("Symlink: %s -> %s", dst, rel_target)
-    return True
+    Runs after every directory has been applied. Returns True when a previous link was removed.
+    """
+    st = sources.stat(op.src)
+    if st is None:
+        return False
+    row = {
+        "dst": str(op.dst),
+        "target": op.target,
+        "rule_id": op.rule_id,
+        "series_id": op.series_id,
+        "movie_id": op.movie_id,
+        "sonarr_instance": op.sonarr_instance,
+        "radarr_instance": op.radarr_instance,
+        "target_inode": st.st_ino,
+        "target_mtime": st.st_mtime,
+    }
+    old = run.managed.get(op.rule_id) if op.rule_id is not None else None
+    moved = bool(old and old["dst"] != row["dst"] and _unlink_managed(old))
+    if old is None or any(old.get(k) != v for k, v in row.items()):
+        row["updated_at"] = time.time()
+        run.links.append(row)
+    return moved
 
 
-def _process_show_link(
-    sonarr: SonarrClient,
-    show_name: str,
-    show_rule: dict,
-    movie_file_path: str,
-    quality: str,
-    extension: str,
-    media_root: str,
-    root_path_prefix: str,
+def _remember_ids(
+    run: _LinkRun, show_rule: dict, series: SeriesRecord, episode_id: Optional[int]
 ) -> None:
-    """Look up a show in Sonarr, find the matching specials episode, and create the symlink."""
+    """Queue the rule's resolved Sonarr IDs for write-back when they differ from the stored ones."""
+    rule_id = show_rule.get("Rule ID")
+    ids = (series.id, series.tvdb_id or None, episode_id, series.instance)
+    stored = (
+        show_rule.get("seriesId"),
+        show_rule.get("tvdbId"),
+        show_rule.get("Episode ID"),
+        show_rule.get("sonarrInstance", 0),
+    )
+    if rule_id is None or ids == stored:
+        return
+    row = dict(zip(("series_id", "tvdb_id", "episode_id", "sonarr_instance"), ids), rule_id=rule_id)
+    with run.lock:
+        run.resolved_ids.append(row)
+
+
+def _resolve_show(
+    run: _LinkRun, show_name: str, show_rule: dict, movie: MovieRecord
+) -> Optional[tuple[SeriesRecord, dict]]:
+    """Resolve a show against the Sonarr index and find its specials episode.
+
+    Uses the rule's stored Sonarr IDs when they are still valid and queues the resolved ones for
+    write-back, so later runs skip the name lookups. Returns None (after tallying why) when the
+    rule is skipped: unknown show, out of scope, unchanged inputs, or no matching episode.
+    """
     try:
-        series_data = sonarr.lookup_series(show_name)
+        series = run.sonarr_index.resolve(
+            list(run.sonarrs.values()),
+            show_name,
+            instance=show_rule.get("sonarrInstance", 0),
+            series_id=show_rule.get("seriesId"),
+            tvdb_id=show_rule.get("tvdbId"),
+        )
     except Exception:
         log.exception("Sonarr lookup failed for %s", show_name)
-        return
-    if not series_data:
+        _tally(run, "lookup_failed")
+        return None
+    if not series or not series.id:
         log.warning("Show not found in Sonarr: %s", show_name)
-        return
-
-    series_id = series_data.get("id", 0)
-    if not series_id:
-        return
+        _tally(run, "show_not_found")
+        return None
 
-    show_path = str(series_data.get("path", "")).replace(root_path_prefix, "", 1)
-    is_anime = "anime" in (series_data.get("seriesType") or "")
-    padding = 3 if is_anime else 2
+    if not run.scope.includes(show_rule.get("Rule ID"), movie.tmdb_id, series.id):
+        _tally(run, "out_of_scope")
+        return None
+    if _is_unchanged(run, movie, series, show_name, show_rule):
+        _remember_ids(run, show_rule, series, show_rule.get("Episode ID"))
+        _tally(run, "unchanged")
+        return None
 
     target_episode = show_rule.get("Episode")
     if target_episode is None:
         log.debug("No target episode for show %s, skipping", show_name)
-        return
+        _tally(run, "no_episode")
+        return None
 
-    episode_data = _find_special_episode(sonarr, series_id, target_episode)
+    try:
+        episode_data = run.episode_cache.special(
+            run.sonarrs[series.instance], series.id, target_episode, show_rule.get("Episode ID")
+        )
+    except Exception:
+        log.exception("Failed to fetch episodes for %s", show_name)
+        _tally(run, "episode_fetch_failed")
+        return None
     if not episode_data:
         log.warning("Episode S00E%s not found for %s", target_episode, show_name)
+        _tally(run, "episode_not_found")
+        return None
+    _remember_ids(run, show_rule, series, episode_data.get("id"))
+    return series, episode_data
+
+
+def _plan_show_link(
+    run: _LinkRun,
+    show_name: str,
+    show_rule: dict,
+    movie: MovieRecord,
+    movie_file_path: str,
+    quality: str,
+    extension: str,
+) -> None:
+    """Resolve a show and its specials episode, then add the symlink it needs to the plan."""
+    start = time.perf_counter()
+    try:
+        resolved = _resolve_show(run, show_name, show_rule, movie)
+    finally:
+        with run.lock:
+            run.resolve_seconds += time.perf_counter() - start
+    if resolved is None:
         return
+    series, episode_data = resolved
+
+    show_path = run.sonarrs[series.instance].media_path(series.path)
+    is_anime = "anime" in series.series_type
+    padding = 3 if is_anime else 2
+    target_episode = show_rule.get("Episode")
 
     episode_title = re.sub(r"\(\d+\)$", "", episode_data.get("title", "")).strip()
     season = show_rule.get("Season", "00")
     parsed_ep = _pad_episode(target_episode, padding)
     season_folder = f"Season {season}"
-    series_title = series_data.get("title", show_name)
+    series_title = series.title or show_name
     dst_filename = f"{series_title} - S{season}E{parsed_ep} - {episode_title} {quality}{extension}"
     dst_rel = os.path.join(show_path, season_folder, dst_filename)
 
-    src_clean = _sanitize_path(movie_file_path)
-    dst_clean = _sanitize_path(dst_rel)
+    op = LinkOp(
+        rule_id=show_rule.get("Rule ID"),
+        src=Path(run.media_root) / _sanitize_path(movie_file_path),
+        dst=Path(run.media_root) / _sanitize_path(dst_rel),
+        series_id=series.id,
+        movie_id=movie.id,
+        sonarr_instance=series.instance,
+        radarr_instance=movie.instance,
+        fingerprint=_fingerprint(movie, series, show_name, show_rule, episode_title),
+        episode_title=episode_title,
+    )
+    with run.lock:
+        run.plan.append(op)
+
 
-    src_abs = Path(media_root) / src_clean
-    dst_abs = Path(media_root) / dst_clean
+def _may_target_show(run: _LinkRun, show_name: str, show_rule: dict) -> bool:
+    """Whether a targeted run can cover a show rule of a movie outside its ``tmdb_ids``.
+
+    Decided before the show is resolved, so a run for one rule or one Sonarr series does not
+    look up every other rule's show in Sonarr. Series are matched against the library index
+    only (stored series ID first): a show the library does not have cannot be a targeted series.
+    """
+    if show_rule.get("Rule ID") in run.scope.rule_ids:
+        return True
+    if not run.scope.series_ids:
+        return False
+    series = run.sonarr_index.find(
+        show_name,
+        instance=show_rule.get("sonarrInstance", 0),
+        series_id=show_rule.get("seriesId"),
+        tvdb_id=show_rule.get("tvdbId"),
+    )
+    return series is not None and series.id in run.scope.series_ids
 
-    _create_relative_symlink(src_abs, dst_abs)
 
+def _plan_movie(run: _LinkRun, movie_name: str, rule: dict) -> None:
+    """Plan the links for every show of one movie rule. Runs on a worker thread."""
+    shows = {name: r for name, r in (rule.get("Shows") or {}).items() if isinstance(r, dict)}
+    tmdb_id = rule.get("Movie DB ID")
+    if not tmdb_id or not str(tmdb_id).isdigit() or int(tmdb_id) == 0:
+        log.debug("Skipping %s: invalid TMDB ID %s", movie_name, tmdb_id)
+        _tally(run, "invalid_tmdb_id", len(shows))
+        return
+    if run.scope.targeted and int(tmdb_id) not in run.scope.tmdb_ids:
+        in_scope = {name: r for name, r in shows.items() if _may_target_show(run, name, r)}
+        if len(in_scope) < len(shows):
+            _tally(run, "out_of_scope", len(shows) - len(in_scope))
+        if not in_scope:
+            return
+        shows = in_scope
+
+    radarr_movie = run.radarr_catalog.by_tmdb(int(tmdb_id))
+    if not radarr_movie or not radarr_movie.has_file:
+        log.debug("Skipping %s: not in Radarr or no file downloaded", movie_name)
+        _tally(run, "no_movie_file", len(shows))
+        return
+
+    movie_file_path, quality, extension = _extract_movie_file_info(
+        radarr_movie, run.radarrs[radarr_movie.instance]
+    )
+    if not movie_file_path:
+        _tally(run, "no_movie_file", len(shows))
+        return
+
+    for show_name, show_rule in shows.items():
+        _plan_show_link(
+            run,
+            show_name=show_name,
+            show_rule=show_rule,
+            movie=radarr_movie,
+            movie_file_path=movie_file_path,
+            quality=quality,
+            extension=extension,
+        )
+
+
+def _record_applied(
+    run: _LinkRun, results: list[tuple[LinkOp, LinkOutcome]], sources: _StatCache
+) -> None:
+    """Book the applied links: outcomes, managed-link rows, rule states and what to rescan."""
+    for op, outcome in results:
+        run.outcomes[outcome] += 1
+        _tally(run, "failed" if outcome is LinkOutcome.FAILED else "linked")
+        if outcome is LinkOutcome.FAILED:
+            continue
+        if outcome is not LinkOutcome.UNCHANGED:
+            run.changed_dirs.add(op.dst.parent)
+        moved = _register_link(run, op, sources)
+        state = run.rule_states.get(op.rule_id) or {}
+        if op.rule_id is not None and state.get("fingerprint") != op.fingerprint:
+            run.new_states.append(
+                {
+                    "rule_id": op.rule_id,
+                    "fingerprint": op.fingerprint,
+                    "episode_title": op.episode_title,
+                    "updated_at": time.time(),
+                }
+            )
+        if moved or outcome is not LinkOutcome.UNCHANGED:
+            run.changed_series.add((op.sonarr_instance, op.series_id))
+            if op.movie_id:
+                run.changed_movies.add((op.radarr_instance, op.movie_id))
+
+
+def _mark_removed_links(run: _LinkRun, removed: list[Path]) -> None:
+    """Queue a rescan for every series that lost a broken link during an audit walk."""
+    if not removed:
+        return
+    series_by_dir = {_series_dir(run, series): (series.instance, series.id) for series in run.sonarr_index}
+    for path in removed:
+        for parent in path.parents:
+            key = series_by_dir.get(parent)
+            if key:
+                run.changed_series.add(key)
+                break
+
+
+def _send_rescans(
+    sonarrs: dict[int, SonarrClient],
+    radarrs: dict[int, RadarrClient],
+    series_keys: set[tuple[int, int]],
+    movie_keys: set[tuple[int, int]],
+) -> None:
+    """Send one coalesced rescan per (instance, series/movie) whose links changed during the run.
+
+    ``RescanSeries`` picks up added and removed links from disk; the much heavier
+    ``RefreshSeries`` (metadata from the indexers) is not needed for that and is not sent.
+    """
+    if not series_keys and not movie_keys:
+        log.info("No link changes, skipping Sonarr/Radarr rescans")
+        return
+    log.info("Rescanning %d series and %d movies", len(series_keys), len(movie_keys))
+    for instance, series_id in sorted(series_keys):
+        sonarr = sonarrs.get(instance)
+        if sonarr is None:
+            log.warning("Sonarr %d is no longer configured, not rescanning series %d", instance, series_id)
+            continue
+        try:
+            sonarr.rescan_series(series_id)
+        except Exception:
+            log.exception("Failed to rescan Sonarr %d series %d", instance, series_id)
+    for instance, movie_id in sorted(movie_keys):
+        radarr = radarrs.get(instance)
+        if radarr is None:
+            log.warning("Radarr %d is no longer configured, not rescanning movie %d", instance, movie_id)
+            continue
+        try:
+            radarr.rescan_movie(movie_id)
+        except Exception:
+            log.exception("Failed to rescan Radarr %d movie %d", instance, movie_id)
+
+
+def _scan_plex_folders(plex: PlexClient, settings: Settings, media_root: str, folders: set[Path]) -> None:
+    """Ask Plex to scan just the season folders whose links changed, one request per folder."""
+    if not folders:
+        return
+    plex_root = settings.plex_media_root or media_root
+    paths = [posixpath.join(plex_root, os.path.relpath(folder, media_root)) for folder in folders]
     try:
-        sonarr.rescan_series(series_id)
-        sonarr.refresh_series(series_id)
+        sent = plex.scan_folders(paths)
     except Exception:
-        log.exception("Failed to refresh Sonarr series %d", series_id)
+        log.exception("Failed to request Plex partial scans")
+        return
+    log.info("Requested Plex scans of %d folders", sent)
 
 
-def run_link_job(settings: Settings) -> None:
-    """Execute one link-job run. No-op when the media path is missing or invalid."""
-    media_root = settings.media_root
-    if not media_root or not os.path.isdir(media_root):
+def _can_run(settings: Settings) -> bool:
+    if not settings.media_root_ready:
         log.info("No valid media root configured, skipping link job")
-        return
+        return False
 
     if not settings.database_url:
         log.error("DATABASE_URL is not set, cannot load link rules")
-        return
+        return False
 
     if not db.init_db(settings.database_url):
         log.error("Failed to initialize database")
-        return
+        return False
+    return True
+
+
+def plan_link_job(
+    settings: Settings, scope: Optional[LinkScope] = None
+) -> tuple[list[tuple[LinkOp, LinkOutcome]], Counter[str]]:
+    """Plan a run without changing anything, for ``main.py --dry-run``.
 
-    lock_path = Path(__file__).parent / "pid.lock"
-    if lock_path.exists():
-        log.info("Lock file exists, another job may be running")
+    Returns each link the run would write or confirm, sorted by destination, with what applying
+    it would do, and the show rules by result; rules skipped because their inputs are unchanged
+    (``"unchanged"``) plan no link. Nothing is written to disk or the database and no commands
+    are sent; the libraries are fetched in full rather than from the snapshot, and sharding is
+    ignored.
+    """
+    if not _can_run(settings):
+        return [], Counter()
+    scope = scope or LinkScope()
+    _policy, sonarrs, radarrs = _clients(settings)
+    movies_dict = db.get_movies_dict(settings.database_url)
+    managed, removed_series = cleanup_managed_links(
+        settings.database_url, _rule_ids(movies_dict), dry_run=True
+    )
+    if not movies_dict:
+        return [], Counter()
+    run = _new_run(settings, settings.media_root, scope, sonarrs, radarrs, managed, removed_series, max_age=0)
+    _plan(run, movies_dict)
+    planned = _apply_plan(run.plan, _StatCache(), workers=settings.link_workers, dry_run=True)
+    return planned, run.rule_results
+
+
+def run_link_job(
+    settings: Settings, scope: Optional[LinkScope] = None, source: str = "cli"
+) -> None:
+    """Execute one link-job run. No-op when the media path is missing or invalid.
+
+    In serve mode runs are serialized by ``scheduler.JobScheduler``. Every run that gets as far
+    as the database is recorded in the ``runs`` table, tagged with ``source`` (what triggered it).
+    """
+    if not _can_run(settings):
+        return
+    media_root = settings.media_root
+    scope = scope or LinkScope()
+    if settings.shard_rules and not scope.targeted:
+        shard = cluster.current_shard(settings.database_url, ttl=settings.lease_ttl_seconds)
+        with cluster.shard_lease(settings.database_url, ttl=settings.lease_ttl_seconds):
+            log.info("Running shard %d of %d", shard.index + 1, shard.count)
+            _measured_run(settings, media_root, scope, source, shard)
         return
 
-    lock_path.touch()
+    # Targeted runs wait for a replica's run to finish; library-wide runs are left to the holder.
+    # A targeted run covers rules of every shard, so in shard mode it also waits for sharded runs.
+    with cluster.job_lease(
+        settings.database_url, ttl=settings.lease_ttl_seconds, wait=scope.targeted
+    ) as held:
+        if not held:
+            log.info("Another replica holds the link-job lease, skipping this run")
+            _RUNS.inc(result="skipped")
+            _save_run(settings, _RunStats(source=source), "skipped")
+            return
+        _measured_run(settings, media_root, scope, source)
+
+
+def _measured_run(
+    settings: Settings,
+    media_root: str,
+    scope: LinkScope,
+    source: str,
+    shard: Optional[cluster.Shard] = None,
+) -> None:
+    stats = _RunStats(source=source)
+    start = time.perf_counter()
+    try:
+        _run(settings, media_root, scope, stats, shard)
+    except Exception as exc:
+        _RUNS.inc(result="failed")
+        _save_run(settings, stats, "failed", f"{type(exc).__name__}: {exc}")
+        raise
+    _RUNS.inc(result="completed")
+    _RUN_SECONDS.observe(time.perf_counter() - start)
+    _LAST_SUCCESS.set(time.time())
+    _save_run(settings, stats, "completed")
+
+
+def _save_run(settings: Settings, stats: _RunStats, status: str, error: Optional[str] = None) -> None:
+    """Record the run in the ``runs`` table and trim it to ``run_history_limit`` rows."""
+    run = {
+        "source": stats.source,
+        "status": status,
+        "started_at": stats.started_at,
+        "finished_at": time.time(),
+        "phases": {name: round(seconds, 4) for name, seconds in stats.phases.items()},
+        "api_calls": sum(client.calls for client in stats.clients),
+        "api_bytes": sum(client.bytes_received for client in stats.clients),
+        "links_created": stats.outcomes[LinkOutcome.CREATED],
+        "links_updated": stats.outcomes[LinkOutcome.UPDATED],
+        "links_unchanged": stats.outcomes[LinkOutcome.UNCHANGED],
+        "links_failed": stats.outcomes[LinkOutcome.FAILED],
+        "rules": dict(stats.rule_results),
+        "error": error,
+    }
     try:
-        _run(settings, media_root)
-    finally:
-        lock_path.unlink(missing_ok=True)
+        db.add_run(settings.database_url, run)
+        db.prune_runs(settings.database_url, settings.run_history_limit)
+    except Exception:
+        log.exception("Failed to record link-job run")
 
 
-def _run(settings: Settings, media_root: str) -> None:
-    remove_broken_symlinks(media_root)
+def _clients(
+    settings: Settings,
+) -> tuple[HttpPolicy, dict[int, SonarrClient], dict[int, RadarrClient]]:
+    """A client per configured Sonarr and Radarr instance, keyed (and ordered) by instance number."""
+    from api_clients import RadarrClient, SonarrClient
 
-    sonarr = SonarrClient(
-        settings.sonarr_api_base,
-        settings.sonarr_api_key,
-        root_path_prefix=settings.sonarr_root_path_prefix,
+    policy = _http_policy(settings)
+    sonarrs = {
+        i.index: SonarrClient(
+            i.api_base, i.api_key, instance=i.index, root_path_prefix=i.root_path_prefix, policy=policy
+        )
+        for i in settings.sonarr_instances
+    }
+    radarrs = {
+        i.index: RadarrClient(
+            i.api_base, i.api_key, instance=i.index, root_path_prefix=i.root_path_prefix, policy=policy
+        )
+        for i in settings.radarr_instances
+    }
+    return policy, sonarrs, radarrs
+
+
+def _new_run(
+    settings: Settings,
+    media_root: str,
+    scope: LinkScope,
+    sonarrs: dict[int, SonarrClient],
+    radarrs: dict[int, RadarrClient],
+    managed: dict[int, dict[str, Any]],
+    removed_series: set[tuple[int, int]],
+    *,
+    max_age: float,
+) -> _LinkRun:
+    """Load the libraries and rule states a run plans against.
+
+    Every instance's library is loaded at the same time, so extra instances do not add their
+    fetch times up; the results are merged in instance order, which sets their precedence.
+    """
+    import catalog
+
+    options: dict[str, Any] = {
+        "max_age": max_age,
+        "stream": settings.stream_library,
+        "refresh": scope.full,
+        # Sharded replicas run at the same time; one of them downloads a stale library.
+        "lease_ttl": settings.lease_ttl_seconds if settings.shard_rules else 0,
+    }
+    workers = len(sonarrs) + len(radarrs)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="catalog") as pool:
+        movies = [
+            pool.submit(catalog.load_radarr_movies, settings.database_url, radarr, **options)
+            for radarr in radarrs.values()
+        ]
+        series = [
+            pool.submit(catalog.load_sonarr_series, settings.database_url, sonarr, **options)
+            for sonarr in sonarrs.values()
+        ]
+        radarr_catalog = catalog.RadarrCatalog(r for future in movies for r in future.result())
+        sonarr_index = catalog.SonarrIndex(r for future in series for r in future.result())
+    if any(not any(sonarr_index.by_id(i, sid) for i in sonarrs) for sid in scope.series_ids):
+        # A webhook for a series added since the snapshot; targeted runs match series by index only.
+        options["refresh"] = True
+        sonarr_index = catalog.SonarrIndex(
+            r
+            for sonarr in sonarrs.values()
+            for r in catalog.load_sonarr_series(settings.database_url, sonarr, **options)
+        )
+    episode_cache = _episode_cache(settings)
+    # The event may have added or renamed a special that a process-wide cache would still hide;
+    # a full run re-reads every title, the only way a renamed special reaches its link.
+    if scope.full:
+        episode_cache.clear()
+    else:
+        episode_cache.forget(scope.series_ids)
+    return _LinkRun(
+        settings=settings,
+        media_root=media_root,
+        sonarrs=sonarrs,
+        radarrs=radarrs,
+        radarr_catalog=radarr_catalog,
+        sonarr_index=sonarr_index,
+        episode_cache=episode_cache,
+        changed_series=removed_series,
+        managed=managed,
+        scope=scope,
+        rule_states=db.get_rule_states(settings.database_url),
     )
-    radarr = RadarrClient(settings.radarr_api_base, settings.radarr_api_key)
 
-    movies_dict = db.get_movies_dict(settings.database_url)
-    if not movies_dict:
-        log.info("No link rules found")
-        return
 
-    radarr_library = radarr.get_movies()
+def _plan(run: _LinkRun, movies_dict: dict[str, Any]) -> None:
+    """Resolve every rule into ``run.plan``, sorted by destination so runs are reproducible."""
+    workers = max(1, run.settings.link_workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plan") as pool:
+        list(pool.map(lambda name: _plan_movie(run, name, movies_dict[name]), sorted(movies_dict)))
+    run.plan.sort(key=lambda op: (op.dst, op.rule_id or 0))
+    _drop_colliding_links(run)
 
-    for movie_name in sorted(movies_dict):
-        rule = movies_dict[movie_name]
-        tmdb_id = rule.get("Movie DB ID")
-        if not tmdb_id or not str(tmdb_id).isdigit() or int(tmdb_id) == 0:
-            log.debug("Skipping %s: invalid TMDB ID %s", movie_name, tmdb_id)
-            continue
 
-        radarr_data = _find_radarr_movie(int(tmdb_id), radarr_library)
-        if not radarr_data or not radarr_data.get("hasFile"):
-            log.debug("Skipping %s: not in Radarr or no file downloaded", movie_name)
-            continue
+def _drop_colliding_links(run: _LinkRun) -> None:
+    """Keep one op per destination in the sorted plan; the other rules planning it fail.
 
-        movie_file_path, quality, extension = _extract_movie_file_info(radarr_data)
-        if not movie_file_path:
+    Two rules can plan the same path, e.g. one movie imported under two titles for the same
+    show. ``managed_links`` holds one row per destination, so the lowest rule ID keeps the link.
+    """
+    kept: list[LinkOp] = []
+    for op in run.plan:
+        if kept and kept[-1].dst == op.dst:
+            log.warning("Rule %s links %s like rule %s, skipping it", op.rule_id, op.dst, kept[-1].rule_id)
+            _tally(run, "failed")
             continue
+        kept.append(op)
+    run.plan = kept
 
-        movie_id = radarr_data.get("id", 0)
 
-        for show_name, show_rule in (rule.get("Shows") or {}).items():
-            if not isinstance(show_rule, dict):
-                continue
-            _process_show_link(
-                sonarr=sonarr,
-                show_name=show_name,
-                show_rule=show_rule,
-                movie_file_path=movie_file_path,
-                quality=quality,
-                extension=extension,
-                media_root=media_root,
-                root_path_prefix=settings.sonarr_root_path_prefix,
+def _rule_ids(movies_dict: dict[str, Any]) -> set[int]:
+    return {show["Rule ID"] for rule in movies_dict.values() for show in rule["Shows"].values()}
+
+
+def _run(
+    settings: Settings,
+    media_root: str,
+    scope: LinkScope,
+    stats: _RunStats,
+    shard: Optional[cluster.Shard] = None,
+) -> None:
+    with stats.phase("load_rules"):
+        movies_dict = db.get_movies_dict(settings.database_url)
+    all_rule_ids = _rule_ids(movies_dict)
+    with stats.phase("cleanup"):
+        if shard and shard.count > 1:
+            movies_dict = {name: rule for name, rule in movies_dict.items() if shard.owns(name)}
+            managed, removed_series = cleanup_managed_links(
+                settings.database_url, _rule_ids(movies_dict), all_rule_ids
             )
+        else:
+            managed, removed_series = cleanup_managed_links(settings.database_url, all_rule_ids)
+    removed: list[Path] = []
+    if settings.link_audit:
+        with stats.phase("audit"):
+            removed = remove_broken_symlinks(media_root)
 
-        if movie_id:
-            try:
-                radarr.rescan_movie(movie_id)
-            except Exception:
-                log.exception("Failed to rescan Radarr movie %d", movie_id)
+    if not movies_dict:
+        log.info("No link rules found")
+        if removed_series:
+            _policy, sonarrs, radarrs = _clients(settings)
+            stats.clients += [*sonarrs.values(), *radarrs.values()]
+            with stats.phase("rescan"):
+                _send_rescans(sonarrs, radarrs, removed_series, set())
+        return
+
+    policy, sonarrs, radarrs = _clients(settings)
+    stats.clients += [*sonarrs.values(), *radarrs.values()]
+    max_age = settings.catalog_max_age_minutes * 60
+    with stats.phase("catalog"):
+        run = _new_run(
+            settings, media_root, scope, sonarrs, radarrs, managed, removed_series, max_age=max_age
+        )
+    with stats.phase("plan"):
+        _plan(run, movies_dict)
+    # Summed over workers, so it can exceed the wall-clock "plan" phase it is part of.
+    stats.add_phase("resolve", run.resolve_seconds)
+    with stats.phase("apply"):
+        sources = _StatCache()
+        _record_applied(run, _apply_plan(run.plan, sources, workers=settings.link_workers), sources)
+    stats.outcomes, stats.rule_results = run.outcomes, run.rule_results
+
+    with stats.phase("save"):
+        db.save_managed_links(settings.database_url, run.links)
+        db.save_rule_states(settings.database_url, run.new_states)
+        db.save_rule_ids(settings.database_url, run.resolved_ids)
+        if max_age > 0:
+            from catalog import save_series_lookups
+
+            save_series_lookups(settings.database_url, run.sonarr_index)
+    for outcome, count in run.outcomes.items():
+        _SYMLINKS.inc(count, outcome=outcome.value)
+    for result, count in run.rule_results.items():
+        _RULES.inc(count, result=result)
+    log.info(
+        "Links: %s, skipped (inputs unchanged)=%d",
+        ", ".join(f"{o.value}={run.outcomes[o]}" for o in LinkOutcome),
+        run.rule_results["unchanged"],
+    )
+    _mark_removed_links(run, removed)
+    with stats.phase("rescan"):
+        _send_rescans(sonarrs, radarrs, run.changed_series, run.changed_movies)
+    if settings.plex_url and settings.plex_api_key and run.changed_dirs:
+        with stats.phase("plex"):
+            from api_clients import PlexClient
+
+            plex = PlexClient(settings.plex_url, settings.plex_api_key, policy=policy)
+            stats.clients.append(plex)
+            _scan_plex_folders(plex, settings, media_root, run.changed_dirs)
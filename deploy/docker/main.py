@@ -2,19 +2,18 @@
 """
 Plex Linker entrypoint.
 
-  serve     — Run FastAPI (health, UI, API) and a background link job.
-  (default) — Run the link job once (one-shot / cron).
+  serve     — Run FastAPI (health, UI, API) and the link-job scheduler.
+  (default) — Run the link job once (one-shot / cron); --dry-run only prints its plan.
+
+Only argparse, logging and config are imported up front: the one-shot run checks the media root
+before it imports the linker (SQLAlchemy, requests), and FastAPI/uvicorn load only for serve.
 """
 from __future__ import annotations
 
 import argparse
 import logging
-import threading
-import time
-from typing import NoReturn
 
 from config import get_settings
-from linker import run_link_job
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,21 +22,25 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
-
-def _job_loop(interval_minutes: int) -> NoReturn:
-    settings = get_settings()
-    while True:
-        try:
-            run_link_job(settings)
-        except Exception:
-            log.exception("Link job failed")
-        time.sleep(max(60, interval_minutes * 60))
-
-
 parser = argparse.ArgumentParser(prog="plex-linker")
+parser.add_argument(
+    "--full",
+    action="store_true",
+    help="re-resolve and relink every rule, even those whose inputs have not changed",
+)
+parser.add_argument(
+    "--audit",
+    action="store_true",
+    help="also walk the whole media root and remove every broken symlink (env PLEX_LINKER_LINK_AUDIT)",
+)
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    help="print the links a run would create or update, without touching disk, database or Sonarr/Radarr",
+)
 sub = parser.add_subparsers(dest="command")
 
-serve_p = sub.add_parser("serve", help="run web app and background link job")
+serve_p = sub.add_parser("serve", help="run web app and link-job scheduler")
 serve_p.add_argument("--host", default="0.0.0.0")
 serve_p.add_argument("--port", type=int, default=8080)
 serve_p.add_argument(
@@ -52,11 +55,39 @@ args = parser.parse_args()
 if args.command == "serve":
     import uvicorn
 
-    from app import app
+    import db
+    from app import app, movie_watcher, scheduler
+    from cluster import ReplicaHeartbeat
 
     settings = get_settings()
+    if settings.shard_rules and db.init_db(settings.database_url):
+        ReplicaHeartbeat(settings.database_url, ttl=settings.lease_ttl_seconds).start()
     interval = args.interval if args.interval is not None else settings.scan_interval_minutes
-    threading.Thread(target=_job_loop, args=(interval,), daemon=True).start()
+    scheduler.start(max(60, interval * 60), settings.full_scan_interval_hours * 3600)
+    if movie_watcher is not None and db.init_db(settings.database_url):
+        movie_watcher.start()
     uvicorn.run(app, host=args.host, port=args.port, log_level="info")
+elif not get_settings().media_root_ready:
+    log.info("No valid media root configured, skipping link job")
+elif args.dry_run:
+    import collections
+
+    from linker import LinkOutcome, LinkScope, plan_link_job
+
+    planned, rule_results = plan_link_job(get_settings(), LinkScope(full=args.full))
+    for op, outcome in planned:
+        print(f"{outcome.value:<9}  {op.dst} -> {op.target}  (rule {op.rule_id})")
+    counts = collections.Counter(outcome for _op, outcome in planned)
+    print(
+        ", ".join(f"{o.value}={counts[o]}" for o in LinkOutcome)
+        + f", skipped (inputs unchanged)={rule_results['unchanged']}"
+    )
 else:
-    run_link_job(get_settings())
+    import dataclasses
+
+    from linker import LinkScope, run_link_job
+
+    settings = get_settings()
+    if args.audit:
+        settings = dataclasses.replace(settings, link_audit=True)
+    run_link_job(settings, LinkScope(full=args.full))
@@ -0,0 +1,142 @@
+"""In-process link-job scheduler: one run at a time, periodic runs, and merged on-demand triggers."""
+from __future__ import annotations
+
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from linker import LinkScope
+
+log = logging.getLogger(__name__)
+
+_ids = itertools.count(1)
+
+
+@dataclass
+class Job:
+    """One link-job run, queued or running or finished."""
+
+    scope: LinkScope
+    sources: list[str]
+    id: int = field(default_factory=lambda: next(_ids))
+    status: str = "queued"
+    queued_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "sources": self.sources,
+            "full": self.scope.full,
+            "targeted": self.scope.targeted,
+            "rule_ids": sorted(self.scope.rule_ids),
+            "tmdb_ids": sorted(self.scope.tmdb_ids),
+            "series_ids": sorted(self.scope.series_ids),
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    """Run link jobs on one background thread so at most one runs per process.
+
+    ``trigger`` queues a run; triggers that arrive while a run is queued or in progress are
+    merged into the single queued job, and ``run`` receives its scope and comma-joined sources.
+    With an interval, a library-wide run is queued that long after the previous library-wide
+    run finished; targeted runs do not move the schedule. With a full interval as well, the
+    first scheduled run due that long after the last full run (or the start) is a full run.
+    """
+
+    def __init__(self, run: Callable[[LinkScope, str], Any], *, history: int = 20) -> None:
+        self._run = run
+        self._cond = threading.Condition()
+        self._current: Optional[Job] = None
+        self._queued: Optional[Job] = None
+        self._recent: deque[Job] = deque(maxlen=history)
+        self._interval: Optional[float] = None
+        self._next_scheduled: Optional[float] = None
+        self._full_interval: Optional[float] = None
+        self._next_full: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(
+        self, interval_seconds: Optional[float] = None, full_interval_seconds: Optional[float] = None
+    ) -> None:
+        """Start the worker thread; with an interval, also run the library-wide job periodically (now first).
+
+        ``full_interval_seconds`` makes a scheduled run rebuild every rule that often (``LinkScope.full``).
+        """
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._interval = interval_seconds
+            if interval_seconds is not None:
+                self._next_scheduled = time.time()
+                if full_interval_seconds:
+                    self._full_interval = full_interval_seconds
+                    self._next_full = self._next_scheduled + full_interval_seconds
+            self._thread = threading.Thread(target=self._loop, name="link-scheduler", daemon=True)
+            self._thread.start()
+
+    def trigger(self, scope: LinkScope, source: str) -> Job:
+        """Queue a run, merging it into the already-queued run if there is one."""
+        with self._cond:
+            if self._queued is None:
+                self._queued = Job(scope=scope, sources=[source])
+            else:
+                self._queued.scope = self._queued.scope.merge(scope)
+                if source not in self._queued.sources:
+                    self._queued.sources.append(source)
+            self._cond.notify()
+            return self._queued
+
+    def status(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "current": self._current.to_dict() if self._current else None,
+                "queued": self._queued.to_dict() if self._queued else None,
+                "next_scheduled_at": self._next_scheduled,
+                "next_full_at": self._next_full,
+                "recent": [job.to_dict() for job in reversed(self._recent)],
+            }
+
+    def _next_job(self) -> Job:
+        with self._cond:
+            while True:
+                if self._queued is None and self._next_scheduled is not None:
+                    wait = self._next_scheduled - time.time()
+                    if wait <= 0:
+                        full = self._next_full is not None and time.time() >= self._next_full
+                        self._queued = Job(scope=LinkScope(full=full), sources=["schedule"])
+                if self._queued is not None:
+                    job, self._queued = self._queued, None
+                    job.status = "running"
+                    job.started_at = time.time()
+                    self._current = job
+                    return job
+                self._cond.wait(wait if self._next_scheduled is not None else None)
+
+    def _loop(self) -> None:
+        while True:
+            job = self._next_job()
+            try:
+                self._run(job.scope, ",".join(job.sources))
+                job.status = "done"
+            except Exception:
+                log.exception("Link job %d failed", job.id)
+                job.status = "failed"
+            with self._cond:
+                job.finished_at = time.time()
+                self._current = None
+                self._recent.append(job)
+                if self._interval is not None and not job.scope.targeted:
+                    self._next_scheduled = job.finished_at + self._interval
+                if self._full_interval is not None and job.scope.full and job.status == "done":
+                    self._next_full = job.finished_at + self._full_interval
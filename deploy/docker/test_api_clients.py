@@ -0,0 +1,188 @@
+"""The streaming JSON array parser behind the library list endpoints, and Plex partial scans."""
+from __future__ import annotations
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+from api_clients import HttpPolicy, PlexClient, _iter_json_array
+
+DOCUMENT = json.dumps(
+    [
+        {"id": 1, "title": "Café: \"Ünïcode\" 🎬", "path": "/movies/A", "ratings": {"imdb": 7.25}},
+        {"id": 2, "nested": [[], {}, [1, [2, [3]]]], "empty": "", "escaped": "a\\b\n "},
+        12345,
+        -0.5e-7,
+        "string, with ] brackets [",
+        None,
+        True,
+        [],
+        {},
+    ],
+    ensure_ascii=False,
+).encode()
+
+
+def _split(data: bytes, size: int) -> Iterator[bytes]:
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(DOCUMENT)])
+def test_matches_json_loads_for_any_chunking(size: int) -> None:
+    assert list(_iter_json_array(_split(DOCUMENT, size))) == json.loads(DOCUMENT)
+
+
+def test_number_split_across_chunks() -> None:
+    assert list(_iter_json_array([b"[12", b"34, 5", b".", b"25e", b"2]"])) == [1234, 525.0]
+
+
+def test_whitespace_and_empty_chunks() -> None:
+    assert list(_iter_json_array([b" \n[", b"", b" 1 ,\t2 ", b"", b"] "])) == [1, 2]
+
+
+@pytest.mark.parametrize("document", [b"[]", b"  [ \n ]"])
+def test_empty_array(document: bytes) -> None:
+    assert list(_iter_json_array(_split(document, 1))) == []
+
+
+def test_yields_before_document_is_complete() -> None:
+    def chunks() -> Iterator[bytes]:
+        yield b'[{"id": 1},'
+        raise AssertionError("read past the first element")
+
+    assert next(_iter_json_array(chunks())) == {"id": 1}
+
+
+@pytest.mark.parametrize(
+    "document",
+    [b"", b"[1, 2", b'[{"id": 1}', b'{"id": 1}', b"[1 2]", b'["unterminated]', b"[1,]"],
+    ids=["empty", "truncated", "truncated-object", "object", "missing-comma", "unterminated", "trailing"],
+)
+def test_malformed(document: bytes) -> None:
+    with pytest.raises(ValueError):
+        list(_iter_json_array(_split(document, 3)))
+
+
+class _PlexStub(BaseHTTPRequestHandler):
+    """A Plex server with nested library locations; ``fail`` maps paths to statuses to answer first."""
+
+    sections = {
+        "MediaContainer": {
+            "Directory": [
+                {
+                    "key": "1",
+                    "title": "TV",
+                    "Location": [{"id": 1, "path": "/data/media/tv"}, {"id": 2, "path": "/mnt/extra/tv/"}],
+                },
+                {"key": "2", "title": "Anime", "Location": [{"id": 3, "path": "/data/media/tv/anime"}]},
+                {"key": "3", "title": "Movies", "Location": [{"id": 4, "path": "/data/media/movies"}]},
+                {"key": "4", "title": "Empty"},
+            ]
+        }
+    }
+    requests: list[tuple[str, dict[str, list[str]], Optional[str]]]
+    fail: dict[str, list[int]]
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        self.requests.append((url.path, query, self.headers.get("X-Plex-Token")))
+        statuses = self.fail.get(url.path + "?" + url.query) or self.fail.get(url.path)
+        if statuses:
+            self._reply(statuses.pop(0), b"{}", {"Retry-After": "0"})
+        elif url.path == "/library/sections":
+            self._reply(200, json.dumps(self.sections).encode())
+        elif re.fullmatch(r"/library/sections/\d+/refresh", url.path):
+            self._reply(200, b"")
+        else:
+            self._reply(404, b"{}")
+
+    def _reply(self, status: int, body: bytes, headers: Optional[dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def plex() -> Iterator[tuple[PlexClient, type[_PlexStub]]]:
+    handler = type("Handler", (_PlexStub,), {"requests": [], "fail": {}})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = PlexClient(
+        f"http://127.0.0.1:{server.server_port}", "token", policy=HttpPolicy(rate=0, backoff=0.01)
+    )
+    yield client, handler
+    server.shutdown()
+    server.server_close()
+
+
+def _scans(handler: type[_PlexStub]) -> list[tuple[str, str]]:
+    return [
+        (path.split("/")[3], query["path"][0])
+        for path, query, _token in handler.requests
+        if path.endswith("/refresh")
+    ]
+
+
+def test_scan_folders_uses_the_longest_matching_location(plex) -> None:
+    client, handler = plex
+    folders = [
+        "/data/media/tv/Show/Season 00",
+        "/data/media/tv/anime/Naruto/Season 00",
+        "/data/media/tv/animeX/Show/Season 00",
+        "/mnt/extra/tv/Other/Season 00",
+        "/data/media/tv/Show/Season 00",
+        "/elsewhere/Show/Season 00",
+        "/data/media/tvshows/Show/Season 00",
+    ]
+    assert client.scan_folders(folders) == 4
+    assert sorted(_scans(handler)) == [
+        ("1", "/data/media/tv/Show/Season 00"),
+        ("1", "/data/media/tv/animeX/Show/Season 00"),
+        ("1", "/mnt/extra/tv/Other/Season 00"),
+        ("2", "/data/media/tv/anime/Naruto/Season 00"),
+    ]
+    assert [path for path, _query, _token in handler.requests].count("/library/sections") == 1
+    assert {token for _path, _query, token in handler.requests} == {"token"}
+
+
+def test_scan_folders_outside_every_section_send_nothing(plex) -> None:
+    client, handler = plex
+    assert client.scan_folders(["/elsewhere/Show/Season 00"]) == 0
+    assert client.scan_folders([]) == 0
+    assert _scans(handler) == []
+
+
+def test_scan_folders_retries_through_send(plex) -> None:
+    client, handler = plex
+    handler.fail = {
+        "/library/sections": [503],
+        "/library/sections/1/refresh?path=%2Fdata%2Fmedia%2Ftv%2FShow%2FSeason+00": [429, 429],
+    }
+    assert client.scan_folders(["/data/media/tv/Show/Season 00", "/data/media/tv/Other/Season 00"]) == 2
+    assert _scans(handler) == [("1", "/data/media/tv/Other/Season 00")] + [
+        ("1", "/data/media/tv/Show/Season 00")
+    ] * 3
+    assert client.calls == 6
+
+
+def test_scan_folders_gives_up_after_max_retries(plex) -> None:
+    client, handler = plex
+    handler.fail = {"/library/sections": [500] * 10}
+    with pytest.raises(requests.HTTPError):
+        client.scan_folders(["/data/media/tv/Show/Season 00"])
+    assert client.calls == HttpPolicy().max_retries + 1
@@ -0,0 +1,51 @@
+"""Keyset cursors of /api/rules."""
+from __future__ import annotations
+
+import base64
+import json
+from typing import Any
+
+import pytest
+from fastapi import HTTPException
+
+from app import _decode_cursor, _encode_cursor
+
+
+def _raw(values: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize(
+    "sort, values",
+    [
+        ("movie_title", ["Movie", "Show", 3]),
+        ("show_name", ["Show", "", 1]),
+        ("tmdb_id", [603, 9]),
+        ("id", [1]),
+    ],
+)
+def test_round_trip(sort: str, values: list[Any]) -> None:
+    assert _decode_cursor(_encode_cursor(values), sort) == values
+
+
+@pytest.mark.parametrize(
+    "sort, cursor",
+    [
+        ("movie_title", "W3siYSI6MX0sMSwyXQ"),
+        ("id", "not base64!"),
+        ("id", _raw({"id": 1})),
+        ("id", _raw([1, 2])),
+        ("id", _raw([[1]])),
+        ("id", _raw(["1"])),
+        ("id", _raw([True])),
+        ("id", _raw([1.5])),
+        ("id", _raw([None])),
+        ("tmdb_id", _raw([{"a": 1}, 2])),
+        ("movie_title", _raw(["Movie", 5, 3])),
+        ("movie_title", _raw(["Movie", "Show", "3"])),
+    ],
+)
+def test_malformed_cursor_is_a_bad_request(sort: str, cursor: str) -> None:
+    with pytest.raises(HTTPException) as error:
+        _decode_cursor(cursor, sort)
+    assert error.value.status_code == 400
@@ -0,0 +1,262 @@
+"""Library indexes and the episode cache; RadarrCatalog against the linear scan it replaced."""
+from __future__ import annotations
+
+import os
+import random
+import re
+from typing import Any, Optional
+
+import pytest
+
+import catalog as catalog_module
+import db
+from api_clients import RadarrClient
+from catalog import EpisodeCache, MovieRecord, RadarrCatalog, SeriesRecord, SonarrIndex
+from linker import _extract_movie_file_info
+
+# An empty prefix leaves Radarr's paths as reported, like the pre-catalog linker did.
+RADARR = RadarrClient("http://radarr.invalid/api/v3", "key", root_path_prefix="")
+
+
+def _find_radarr_movie(tmdb_id: int, radarr_movies: list[dict]) -> Optional[dict]:
+    for movie in radarr_movies:
+        if movie.get("tmdbId") == tmdb_id:
+            return movie
+    return None
+
+
+def _extract_movie_file_info_dict(radarr_data: dict) -> tuple[str, str, str]:
+    movie_file = radarr_data.get("movieFile")
+    if not movie_file:
+        return "", "", ".mkv"
+
+    movie_path = radarr_data.get("path", "")
+    relative = movie_file.get("relativePath", "")
+    quality_name = ((movie_file.get("quality") or {}).get("quality") or {}).get("name", "")
+    extension = (
+        re.sub(re.escape(quality_name), "", relative.rsplit(" ", 1)[-1])
+        if quality_name
+        else os.path.splitext(relative)[1]
+    )
+    absolute = os.path.join(movie_path, relative).replace(":", "-")
+    return absolute, quality_name, extension
+
+
+def _scan(tmdb_id: int, movies: list[dict]) -> Optional[tuple[str, str, str]]:
+    """What the linker linked before the catalog: None when it skipped the rule."""
+    movie = _find_radarr_movie(tmdb_id, movies)
+    if not movie or not movie.get("hasFile"):
+        return None
+    return _extract_movie_file_info_dict(movie)
+
+
+def _indexed(tmdb_id: int, catalog: RadarrCatalog) -> Optional[tuple[str, str, str]]:
+    record = catalog.by_tmdb(tmdb_id)
+    if not record or not record.has_file:
+        return None
+    return _extract_movie_file_info(record, RADARR)
+
+
+def _movie(movie_id: int, tmdb_id: int, *, quality: Optional[str] = "Bluray-1080p", **extra: Any) -> dict:
+    movie: dict[str, Any] = {
+        "id": movie_id,
+        "tmdbId": tmdb_id,
+        "imdbId": f"tt{tmdb_id:07d}",
+        "path": f"/movies/Movie: {movie_id}",
+        "hasFile": True,
+        "movieFile": {
+            "id": 1000 + movie_id,
+            "relativePath": f"Movie {movie_id} {quality or 'untagged'}.mkv",
+            "quality": {"quality": {"name": quality}} if quality is not None else {},
+        },
+    }
+    movie.update(extra)
+    return movie
+
+
+def _catalog(movies: list[dict]) -> RadarrCatalog:
+    return RadarrCatalog(MovieRecord.from_radarr(m) for m in movies)
+
+
+@pytest.mark.parametrize(
+    "movie",
+    [
+        _movie(1, 100),
+        _movie(2, 200, quality="WEBDL-2160p"),
+        _movie(3, 300, quality=None),
+        _movie(4, 400, quality=""),
+        _movie(5, 500, hasFile=False),
+        _movie(6, 600, hasFile=False, movieFile=None),
+        {"id": 7, "tmdbId": 700, "path": "/movies/Movie 7", "hasFile": True},
+        {"id": 8, "tmdbId": 800, "hasFile": True, "movieFile": {"relativePath": "Movie 8 HDTV-720p.mp4"}},
+    ],
+    ids=[
+        "quality",
+        "uhd",
+        "no-quality",
+        "empty-quality",
+        "no-file",
+        "no-movie-file",
+        "missing-movie-file",
+        "no-path",
+    ],
+)
+def test_single_movie_matches_scan(movie: dict) -> None:
+    assert _indexed(movie["tmdbId"], _catalog([movie])) == _scan(movie["tmdbId"], [movie])
+
+
+def test_quality_and_extension() -> None:
+    record = MovieRecord.from_radarr(_movie(1, 100, quality="Bluray-1080p"))
+    assert _extract_movie_file_info(record, RADARR) == (
+        "/movies/Movie- 1/Movie 1 Bluray-1080p.mkv",
+        "Bluray-1080p",
+        ".mkv",
+    )
+    record = MovieRecord.from_radarr(_movie(2, 200, quality=None))
+    assert _extract_movie_file_info(record, RADARR)[1:] == ("", ".mkv")
+
+
+def test_missing_movie_file() -> None:
+    record = MovieRecord.from_radarr({"id": 1, "tmdbId": 100, "path": "/movies/Movie 1", "hasFile": True})
+    assert _extract_movie_file_info(record, RADARR) == ("", "", ".mkv")
+
+
+def test_duplicate_tmdb_id_first_match_wins() -> None:
+    movies = [_movie(1, 100), _movie(2, 100, quality="WEBDL-2160p"), _movie(3, 100, hasFile=False)]
+    catalog = _catalog(movies)
+    assert catalog.by_tmdb(100).id == 1
+    assert _indexed(100, catalog) == _scan(100, movies)
+
+
+def test_duplicate_tmdb_id_prefers_downloaded_file() -> None:
+    # The scan stopped at the first entry and skipped the rule; the catalog links the copy on disk.
+    movies = [_movie(1, 100, hasFile=False), _movie(2, 100)]
+    assert _scan(100, movies) is None
+    assert _catalog(movies).by_tmdb(100).id == 2
+
+
+def test_other_indexes() -> None:
+    catalog = _catalog([_movie(1, 100), _movie(2, 100)])
+    assert catalog.by_imdb("tt0000100").id == 1
+    assert catalog.by_id(0, 2).id == 2
+    assert catalog.by_id(1, 2) is None
+    assert len(catalog) == 2
+
+
+def test_random_library_matches_scan() -> None:
+    rng = random.Random(1)
+    qualities = ["Bluray-1080p", "WEBDL-2160p", "HDTV-720p", "", None]
+    movies = [
+        _movie(i, rng.randrange(1, 400), quality=rng.choice(qualities), hasFile=True)
+        if rng.random() < 0.9
+        else _movie(i, rng.randrange(400, 500), hasFile=False, movieFile=None)
+        for i in range(1, 2000)
+    ]
+    catalog = _catalog(movies)
+    for tmdb_id in range(0, 510):
+        assert _indexed(tmdb_id, catalog) == _scan(tmdb_id, movies), tmdb_id
+
+
+def test_sonarr_index_find_never_asks_sonarr() -> None:
+    index = SonarrIndex(
+        [
+            SeriesRecord(5, "Show: One", 70, "/tv/One", "standard"),
+            SeriesRecord(5, "Other", 71, "/tv/Other", "standard", instance=1),
+        ]
+    )
+    assert index.find("show one").id == 5
+    assert index.find("Unknown", instance=1, series_id=5).title == "Other"
+    assert index.find("Unknown", series_id=9, tvdb_id=71).instance == 1
+    assert index.find("Unknown") is None
+
+
+def test_non_latin_titles_keep_their_own_keys() -> None:
+    index = SonarrIndex(
+        [
+            SeriesRecord(1, "Игра престолов", 70, "/tv/1", "standard"),
+            SeriesRecord(2, "鬼滅の刃", 71, "/tv/2", "anime"),
+            SeriesRecord(3, "Pokémon", 72, "/tv/3", "anime"),
+            SeriesRecord(4, "Pokmon", 73, "/tv/4", "standard"),
+            SeriesRecord(5, "!!!", 74, "/tv/5", "standard"),
+        ]
+    )
+    assert index.find("鬼滅の刃").id == 2
+    assert index.find("игра Престолов!").id == 1
+    assert index.find("POKÉMON").id == 3
+    assert index.find("進撃の巨人") is None
+    assert index.find("?") is None
+
+
+class _Lookups:
+    instance = 0
+
+    def __init__(self, series: dict[str, dict]) -> None:
+        self.series = series
+        self.lookups: list[str] = []
+
+    def lookup_series(self, title: str) -> Optional[dict]:
+        self.lookups.append(title)
+        return self.series.get(title)
+
+
+def test_remote_lookups_are_remembered_per_title() -> None:
+    sonarr = _Lookups(
+        {
+            "進撃の巨人": {"id": 8, "title": "進撃の巨人", "path": "/tv/8"},
+            "?": {"id": 9, "title": "?", "path": "/tv/9"},
+            "!": {"id": 10, "title": "!", "path": "/tv/10"},
+        }
+    )
+    index = SonarrIndex([SeriesRecord(2, "鬼滅の刃", 71, "/tv/2", "anime")])
+    assert index.resolve([sonarr], "進撃の巨人").id == 8
+    assert index.resolve([sonarr], "進撃の巨人").id == 8
+    assert index.resolve([sonarr], "ワンピース") is None
+    assert index.resolve([sonarr], "ワンピース") is None
+    # Titles without a key are never remembered, so they cannot share one lookup result.
+    assert index.resolve([sonarr], "?").id == 9
+    assert index.resolve([sonarr], "!").id == 10
+    assert sonarr.lookups == ["進撃の巨人", "ワンピース", "?", "!"]
+    assert [record.id for record in index.fetched] == [8, 9, 10]
+
+
+class _Sonarr:
+    def __init__(self, instance: int) -> None:
+        self.instance = instance
+        self.fetches = 0
+
+    def get_episodes(self, series_id: int) -> list[dict]:
+        self.fetches += 1
+        return [{"id": series_id * 10, "seasonNumber": 0, "episodeNumber": 1, "title": f"v{self.fetches}"}]
+
+
+def test_episode_cache_forget() -> None:
+    cache = EpisodeCache(ttl_seconds=3600)
+    first, second = _Sonarr(0), _Sonarr(1)
+    for sonarr in (first, second):
+        cache.special(sonarr, 5, 1)
+        cache.special(sonarr, 6, 1)
+    cache.forget({5})
+    assert len(cache) == 2
+    assert cache.special(first, 5, 1)["title"] == "v3"
+    assert cache.special(first, 6, 1)["title"] == "v2"
+    assert second.fetches == 2
+
+
+def test_download_reads_snapshot_refreshed_by_another_replica(db_url: str) -> None:
+    def fetch() -> list[SeriesRecord]:
+        fetches.append(1)
+        return [SeriesRecord(1, "Mine", 70, "/tv/Mine", "standard")]
+
+    fetches: list[int] = []
+    theirs = [SeriesRecord(2, "Theirs", 71, "/tv/Theirs", "standard")]
+    db.replace_catalog(db_url, "sonarr", 0, [r._asdict() for r in theirs], 100.0)
+    seen = {"full_at": 50.0}
+    # The snapshot was fetched in full after this run looked at it: read it instead of downloading.
+    assert catalog_module._download(db_url, "sonarr", 0, seen, fetch, SeriesRecord, 60) == theirs
+    assert not fetches
+    # Without a lease (one replica) or when nothing newer arrived, download.
+    assert catalog_module._download(db_url, "sonarr", 0, seen, fetch, SeriesRecord, 0)[0].title == "Mine"
+    seen = db.get_catalog_sync(db_url, "sonarr", 0)
+    assert catalog_module._download(db_url, "sonarr", 0, seen, fetch, SeriesRecord, 60)[0].title == "Mine"
+    assert len(fetches) == 2
+    assert db.live_leases(db_url, "catalog/") == []
@@ -0,0 +1,50 @@
+"""Job and shard leases: a targeted run never overlaps a sharded run."""
+from __future__ import annotations
+
+import threading
+import time
+
+import cluster
+import db
+
+TTL = 10.0
+
+
+def _enter_in_thread(lease, entered: threading.Event) -> threading.Thread:
+    def run() -> None:
+        with lease:
+            entered.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_job_lease_waits_for_sharded_runs(db_url: str) -> None:
+    entered = threading.Event()
+    with cluster.shard_lease(db_url, ttl=TTL):
+        shard_leases = db.live_leases(db_url, cluster.SHARD_LEASE_PREFIX)
+        assert shard_leases == [cluster.SHARD_LEASE_PREFIX + cluster.HOLDER]
+        thread = _enter_in_thread(cluster.job_lease(db_url, ttl=TTL, wait=True), entered)
+        assert not entered.wait(1.5)
+    assert entered.wait(5)
+    thread.join(5)
+    assert db.live_leases(db_url, cluster.LINK_JOB_LEASE) == []
+
+
+def test_sharded_run_waits_for_job_lease(db_url: str) -> None:
+    entered = threading.Event()
+    with cluster.job_lease(db_url, ttl=TTL, wait=False) as held:
+        assert held
+        thread = _enter_in_thread(cluster.shard_lease(db_url, ttl=TTL), entered)
+        assert not entered.wait(1.5)
+    assert entered.wait(5)
+    thread.join(5)
+
+
+def test_expired_shard_lease_is_ignored(db_url: str) -> None:
+    assert db.acquire_lease(db_url, cluster.SHARD_LEASE_PREFIX + "gone:1", "gone:1", -1)
+    start = time.monotonic()
+    with cluster.job_lease(db_url, ttl=TTL, wait=False) as held:
+        assert held
+    assert time.monotonic() - start < 1
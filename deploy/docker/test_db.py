@@ -0,0 +1,130 @@
+"""Database helpers on a throwaway SQLite file."""
+from __future__ import annotations
+
+import random
+import time
+from typing import Any, Optional
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def rules(db_url: str) -> list[dict[str, Any]]:
+    rng = random.Random(3)
+    # Few distinct titles and TMDB IDs, so every sort needs its tie-breaking columns.
+    db.upsert_rules(
+        db_url,
+        [
+            {
+                "movie_title": f"Movie {i % 9}",
+                "tmdb_id": rng.randrange(5),
+                "show_name": f"Show {i % 13} {'%' if i % 4 == 0 else '_'}",
+                "episode": i,
+                "season": "00",
+                "episode_id": None,
+                "series_id": None,
+                "tvdb_id": None,
+                "sonarr_instance": None,
+            }
+            for i in range(60)
+        ],
+    )
+    all_rules = db.list_rules(db_url)
+    linked = all_rules[::5]
+    db.save_managed_links(
+        db_url,
+        [
+            {
+                "dst": f"/media/tv/{rule['id']}.mkv",
+                "target": "../movie.mkv",
+                "rule_id": rule["id"],
+                "updated_at": time.time(),
+            }
+            for rule in linked
+        ],
+    )
+    return db.list_rules(db_url)
+
+
+def _pages(db_url: str, limit: int, **filters: Any) -> list[int]:
+    """Rule IDs over every keyset page, asserting no page is longer than ``limit``."""
+    sort = filters.get("sort", "movie_title")
+    ids: list[int] = []
+    after: Optional[list[Any]] = None
+    while True:
+        page = db.list_rules(db_url, limit=limit, after=after, **filters)
+        assert len(page) <= limit
+        ids += [rule["id"] for rule in page]
+        if len(page) < limit:
+            return ids
+        after = db.rule_sort_key(page[-1], sort)
+
+
+@pytest.mark.parametrize("sort", list(db.RULE_SORTS))
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 7, 60])
+def test_keyset_pages_cover_every_rule_once(
+    rules, db_url: str, sort: str, descending: bool, limit: int
+) -> None:
+    columns = [c.name for c in db.RULE_SORTS[sort]]
+    expected = sorted(rules, key=lambda r: [r[c] for c in columns], reverse=descending)
+    assert _pages(db_url, limit, sort=sort, descending=descending) == [r["id"] for r in expected]
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {"movie": "movie 3"},
+        {"show": "%"},
+        {"show": "_"},
+        {"tmdb_id": 2},
+        {"linked": True},
+        {"linked": False, "sort": "show_name", "descending": True},
+    ],
+)
+def test_filtered_pages_match_unpaged_query(rules, db_url: str, filters: dict[str, Any]) -> None:
+    unpaged = [rule["id"] for rule in db.list_rules(db_url, **filters)]
+    assert unpaged
+    assert _pages(db_url, 4, **filters) == unpaged
+
+
+def test_linked_flag(rules) -> None:
+    linked = [rule for rule in rules if rule["linked"]]
+    assert len(linked) == 12
+    assert all(isinstance(rule["linked"], bool) for rule in rules)
+
+
+def test_like_wildcards_are_literal(rules, db_url: str) -> None:
+    names = {rule["show_name"] for rule in db.list_rules(db_url, show="%")}
+    assert names == {rule["show_name"] for rule in rules if "%" in rule["show_name"]}
+
+
+def _movie_row(movie_id: int, quality: str = "Bluray-1080p", instance: int = 0) -> dict[str, Any]:
+    return {
+        "instance": instance,
+        "id": movie_id,
+        "tmdb_id": 100 + movie_id,
+        "imdb_id": f"tt{movie_id}",
+        "path": f"/movies/{movie_id}",
+        "has_file": True,
+        "movie_file_id": movie_id,
+        "relative_path": f"{movie_id}.mkv",
+        "quality": quality,
+    }
+
+
+def test_catalog_writes_overwrite_existing_keys(db_url: str) -> None:
+    db.replace_catalog(db_url, "radarr", 0, [_movie_row(1), _movie_row(2)], 10.0)
+    db.replace_catalog(db_url, "radarr", 1, [_movie_row(1, instance=1)], 10.0)
+    # As if another replica wrote these rows and the sync state in between.
+    with db.get_engine(db_url).begin() as conn:
+        db._upsert(conn, db.catalog_movies, [_movie_row(2, "stale")])
+        db._set_catalog_sync(conn, "radarr", 0, full_at=5.0, synced_at=5.0)
+    db.update_catalog(db_url, "radarr", 0, [_movie_row(2, "WEBDL-2160p"), _movie_row(3)], [1], synced_at=20.0)
+    rows = db.list_catalog(db_url, "radarr", 0)
+    assert [(r["id"], r["quality"]) for r in rows] == [(2, "WEBDL-2160p"), (3, "Bluray-1080p")]
+    sync = db.get_catalog_sync(db_url, "radarr", 0)
+    assert sync == {"service": "radarr", "instance": 0, "full_at": 5.0, "synced_at": 20.0}
+    assert len(db.list_catalog(db_url, "radarr", 1)) == 1
@@ -0,0 +1,144 @@
+"""The apply stage and the managed-links registry on a temporary media root."""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Optional
+
+import db
+import linker
+from catalog import EpisodeCache, RadarrCatalog, SonarrIndex
+from config import Settings
+from linker import LinkOp, LinkOutcome
+
+
+def _run(db_url: str, root: Path, managed: Optional[dict[int, dict]] = None) -> linker._LinkRun:
+    return linker._LinkRun(
+        settings=Settings(database_url=db_url, media_root=str(root)),
+        media_root=str(root),
+        sonarrs={},
+        radarrs={},
+        radarr_catalog=RadarrCatalog([]),
+        sonarr_index=SonarrIndex([]),
+        episode_cache=EpisodeCache(),
+        managed=managed or {},
+        rule_states=db.get_rule_states(db_url),
+    )
+
+
+def _op(root: Path, rule_id: int, name: str, movie: str = "Movie.mkv") -> LinkOp:
+    return LinkOp(
+        rule_id=rule_id,
+        src=root / "movies" / movie,
+        dst=root / "tv" / "Show" / "Season 00" / name,
+        series_id=5,
+        movie_id=1,
+        sonarr_instance=0,
+        radarr_instance=0,
+        fingerprint=f"fingerprint {rule_id}",
+        episode_title="Special",
+    )
+
+
+def _apply(run: linker._LinkRun) -> list[tuple[LinkOp, LinkOutcome]]:
+    """What ``_run`` does after planning, up to saving the registry."""
+    run.plan.sort(key=lambda op: (op.dst, op.rule_id or 0))
+    linker._drop_colliding_links(run)
+    sources = linker._StatCache()
+    applied = linker._apply_plan(run.plan, sources, workers=2)
+    linker._record_applied(run, applied, sources)
+    db.save_managed_links(run.settings.database_url, run.links)
+    db.save_rule_states(run.settings.database_url, run.new_states)
+    return applied
+
+
+def _managed(db_url: str, root: Path) -> list[tuple[str, int]]:
+    rows = db.list_managed_links(db_url)
+    return sorted((os.path.relpath(row["dst"], root), row["rule_id"]) for row in rows)
+
+
+def _media(tmp_path: Path) -> Path:
+    (tmp_path / "movies").mkdir()
+    for movie in ("Movie.mkv", "Other.mkv"):
+        (tmp_path / "movies" / movie).write_bytes(b"")
+    return tmp_path
+
+
+def test_rules_planning_the_same_destination_link_once(db_url: str, tmp_path: Path) -> None:
+    root = _media(tmp_path)
+    run = _run(db_url, root)
+    # The same movie imported under two titles for the same show plans identical links.
+    run.plan = [_op(root, 2, "Special.mkv"), _op(root, 3, "Other.mkv"), _op(root, 1, "Special.mkv")]
+    applied = _apply(run)
+    assert [(op.rule_id, outcome) for op, outcome in applied] == [
+        (3, LinkOutcome.CREATED),
+        (1, LinkOutcome.CREATED),
+    ]
+    assert run.rule_results == {"failed": 1, "linked": 2}
+    assert _managed(db_url, root) == [
+        ("tv/Show/Season 00/Other.mkv", 3),
+        ("tv/Show/Season 00/Special.mkv", 1),
+    ]
+    assert set(db.get_rule_states(db_url)) == {1, 3}
+
+
+def test_second_apply_changes_nothing(db_url: str, tmp_path: Path) -> None:
+    root = _media(tmp_path)
+    run = _run(db_url, root)
+    run.plan = [_op(root, 1, "Special.mkv")]
+    _apply(run)
+    managed, removed = linker.cleanup_managed_links(db_url, {1})
+    assert list(managed) == [1] and not removed
+
+    run = _run(db_url, root, managed)
+    run.plan = [_op(root, 1, "Special.mkv")]
+    assert [outcome for _op_, outcome in _apply(run)] == [LinkOutcome.UNCHANGED]
+    assert not run.links and not run.new_states and not run.changed_series
+
+
+def test_moved_link_replaces_the_old_one(db_url: str, tmp_path: Path) -> None:
+    root = _media(tmp_path)
+    run = _run(db_url, root)
+    run.plan = [_op(root, 1, "Special.mkv")]
+    _apply(run)
+    managed, _removed = linker.cleanup_managed_links(db_url, {1})
+
+    run = _run(db_url, root, managed)
+    run.plan = [_op(root, 1, "Special Renamed.mkv", movie="Other.mkv")]
+    _apply(run)
+    assert not (root / "tv" / "Show" / "Season 00" / "Special.mkv").is_symlink()
+    target = os.readlink(root / "tv" / "Show" / "Season 00" / "Special Renamed.mkv")
+    assert target == "../../../movies/Other.mkv"
+    assert _managed(db_url, root) == [("tv/Show/Season 00/Special Renamed.mkv", 1)]
+    assert run.changed_series == {(0, 5)}
+
+
+def test_missing_source_fails_without_registering(db_url: str, tmp_path: Path) -> None:
+    root = _media(tmp_path)
+    run = _run(db_url, root)
+    run.plan = [_op(root, 1, "Special.mkv", movie="Missing.mkv")]
+    assert [outcome for _op_, outcome in _apply(run)] == [LinkOutcome.FAILED]
+    assert run.rule_results == {"failed": 1}
+    assert db.list_managed_links(db_url) == []
+
+
+def test_cleanup_removes_links_of_deleted_rules(db_url: str, tmp_path: Path) -> None:
+    root = _media(tmp_path)
+    run = _run(db_url, root)
+    run.plan = [_op(root, 1, "One.mkv"), _op(root, 2, "Two.mkv"), _op(root, 3, "Three.mkv")]
+    _apply(run)
+    season = root / "tv" / "Show" / "Season 00"
+    # Replaced by hand: no longer the linker's link, so it is left alone and forgotten.
+    (season / "Three.mkv").unlink()
+    (season / "Three.mkv").symlink_to("elsewhere.mkv")
+
+    managed, removed = linker.cleanup_managed_links(db_url, {1}, dry_run=True)
+    assert list(managed) == [1] and not removed
+    assert (season / "Two.mkv").is_symlink()
+
+    managed, removed = linker.cleanup_managed_links(db_url, {1})
+    assert list(managed) == [1]
+    assert removed == {(0, 5)}
+    assert not (season / "Two.mkv").is_symlink()
+    assert os.readlink(season / "Three.mkv") == "elsewhere.mkv"
+    assert _managed(db_url, root) == [("tv/Show/Season 00/One.mkv", 1)]
@@ -0,0 +1,43 @@
+"""Periodic runs of the job scheduler, with short intervals."""
+from __future__ import annotations
+
+import threading
+import time
+
+from linker import LinkScope
+from scheduler import JobScheduler
+
+
+def _record(runs: list[LinkScope], count: int, done: threading.Event):
+    def run(scope: LinkScope, source: str) -> None:
+        assert source == "schedule"
+        runs.append(scope)
+        if len(runs) == count:
+            done.set()
+        time.sleep(0.02)
+
+    return run
+
+
+def test_scheduled_runs_are_full_every_full_interval() -> None:
+    runs: list[LinkScope] = []
+    done = threading.Event()
+    scheduler = JobScheduler(_record(runs, 12, done))
+    scheduler.start(0.03, 0.2)
+    assert done.wait(10)
+    full = [i for i, scope in enumerate(runs) if scope.full]
+    # The first run is incremental; then one full run per full interval, the rest incremental.
+    assert full and full[0] > 0
+    assert len(full) < len(runs) // 2
+    assert all(b - a > 1 for a, b in zip(full, full[1:]))
+    assert scheduler.status()["next_full_at"] > time.time() - 0.2
+
+
+def test_no_full_runs_without_full_interval() -> None:
+    runs: list[LinkScope] = []
+    done = threading.Event()
+    scheduler = JobScheduler(_record(runs, 5, done))
+    scheduler.start(0.01)
+    assert done.wait(10)
+    assert not any(scope.full for scope in runs)
+    assert scheduler.status()["next_full_at"] is None
@@ -0,0 +1,175 @@
+"""Radarr/Sonarr webhook payloads to link-job scopes, and the debouncer that merges them."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+import pytest
+
+import webhooks
+from linker import LinkScope
+
+# Trimmed from payloads Radarr v5 and Sonarr v4 send to a "Webhook" connection.
+RADARR_MOVIE = {
+    "id": 12,
+    "title": "The Movie",
+    "year": 2021,
+    "releaseDate": "2021-10-01",
+    "folderPath": "/movies/The Movie (2021)",
+    "tmdbId": 603,
+    "imdbId": "tt0133093",
+}
+SONARR_SERIES = {
+    "id": 7,
+    "title": "The Show",
+    "titleSlug": "the-show",
+    "path": "/tv/The Show",
+    "tvdbId": 81189,
+    "type": "standard",
+}
+RADARR_DOWNLOAD = {
+    "eventType": "Download",
+    "instanceName": "Radarr",
+    "movie": RADARR_MOVIE,
+    "remoteMovie": {"tmdbId": 603, "imdbId": "tt0133093", "title": "The Movie", "year": 2021},
+    "movieFile": {
+        "id": 345,
+        "relativePath": "The Movie (2021) Bluray-1080p.mkv",
+        "path": "/downloads/The.Movie.2021.1080p.BluRay.mkv",
+        "quality": "Bluray-1080p",
+        "qualityVersion": 1,
+        "size": 8_589_934_592,
+    },
+    "isUpgrade": False,
+    "downloadClient": "qBittorrent",
+}
+SONARR_DOWNLOAD = {
+    "eventType": "Download",
+    "instanceName": "Sonarr",
+    "series": SONARR_SERIES,
+    "episodes": [{"id": 901, "episodeNumber": 3, "seasonNumber": 0, "title": "Special"}],
+    "episodeFile": {"id": 77, "relativePath": "Season 00/The Show - S00E03.mkv", "quality": "HDTV-720p"},
+    "isUpgrade": False,
+}
+
+
+def _event(payload: dict[str, Any], event: str, **changes: Any) -> dict[str, Any]:
+    return {**payload, "eventType": event, **changes}
+
+
+RADARR_CASES = {
+    "download": (RADARR_DOWNLOAD, {603}),
+    "upgrade": (_event(RADARR_DOWNLOAD, "Download", isUpgrade=True, deletedFiles=[{"id": 300}]), {603}),
+    "rename": (
+        {"eventType": "Rename", "movie": RADARR_MOVIE, "renamedMovieFiles": [{"id": 345}]},
+        {603},
+    ),
+    "file-delete": (
+        {"eventType": "MovieFileDelete", "movie": RADARR_MOVIE, "deleteReason": "upgrade"},
+        {603},
+    ),
+    "movie-delete": ({"eventType": "MovieDelete", "movie": RADARR_MOVIE, "deletedFiles": True}, {603}),
+    "test": ({"eventType": "Test", "movie": {"id": 1, "title": "Test Title", "tmdbId": 0}}, None),
+    "grab": (_event(RADARR_DOWNLOAD, "Grab"), None),
+    "health": ({"eventType": "Health", "level": "warning", "message": "Indexers unavailable"}, None),
+    "no-movie": ({"eventType": "Download"}, None),
+    "malformed-id": ({"eventType": "Download", "movie": {"tmdbId": "abc"}}, None),
+    "movie-not-object": ({"eventType": "Download", "movie": ["tmdbId", 603]}, None),
+    "string-id": ({"eventType": "Download", "movie": {"tmdbId": "603"}}, {603}),
+}
+SONARR_CASES = {
+    "download": (SONARR_DOWNLOAD, {7}),
+    "upgrade": (_event(SONARR_DOWNLOAD, "Download", isUpgrade=True, deletedFiles=[{"id": 70}]), {7}),
+    "rename": ({"eventType": "Rename", "series": SONARR_SERIES, "renamedEpisodeFiles": [{"id": 77}]}, {7}),
+    "file-delete": (
+        {"eventType": "EpisodeFileDelete", "series": SONARR_SERIES, "deleteReason": "manual"},
+        {7},
+    ),
+    "series-delete": ({"eventType": "SeriesDelete", "series": SONARR_SERIES, "deletedFiles": False}, {7}),
+    "test": (
+        {"eventType": "Test", "series": {"id": 1, "title": "Test Title", "tvdbId": 1234}},
+        None,
+    ),
+    "grab": (_event(SONARR_DOWNLOAD, "Grab"), None),
+    "no-series": ({"eventType": "Rename"}, None),
+    "malformed-id": ({"eventType": "Download", "series": {"id": {"value": 7}}}, None),
+    "zero-id": ({"eventType": "Download", "series": {"id": 0}}, None),
+}
+
+
+@pytest.mark.parametrize("payload, tmdb_ids", RADARR_CASES.values(), ids=RADARR_CASES.keys())
+def test_radarr_scope(payload: dict[str, Any], tmdb_ids: Any) -> None:
+    scope = webhooks.radarr_scope(payload)
+    if tmdb_ids is None:
+        assert scope is None
+    else:
+        assert scope == LinkScope(targeted=True, tmdb_ids=frozenset(tmdb_ids))
+
+
+@pytest.mark.parametrize("payload, series_ids", SONARR_CASES.values(), ids=SONARR_CASES.keys())
+def test_sonarr_scope(payload: dict[str, Any], series_ids: Any) -> None:
+    scope = webhooks.sonarr_scope(payload)
+    if series_ids is None:
+        assert scope is None
+    else:
+        assert scope == LinkScope(targeted=True, series_ids=frozenset(series_ids))
+
+
+class _Runs:
+    def __init__(self) -> None:
+        self.scopes: list[tuple[float, LinkScope]] = []
+        self.ran = threading.Event()
+
+    def __call__(self, scope: LinkScope) -> None:
+        self.scopes.append((time.monotonic(), scope))
+        self.ran.set()
+
+
+def test_debouncer_merges_a_burst_into_one_run() -> None:
+    runs = _Runs()
+    debouncer = webhooks.Debouncer(runs, delay=0.2)
+    start = time.monotonic()
+    debouncer.submit(LinkScope(targeted=True, tmdb_ids=frozenset({1})))
+    debouncer.submit(LinkScope(targeted=True, series_ids=frozenset({7})))
+    assert runs.ran.wait(5)
+    time.sleep(0.3)
+    [(ran_at, scope)] = runs.scopes
+    assert ran_at - start >= 0.2
+    assert scope == LinkScope(targeted=True, tmdb_ids=frozenset({1}), series_ids=frozenset({7}))
+
+
+def test_debouncer_waits_for_a_quiet_period() -> None:
+    runs = _Runs()
+    debouncer = webhooks.Debouncer(runs, delay=0.2, max_delay=5)
+    start = time.monotonic()
+    for tmdb_id in range(3):
+        debouncer.submit(LinkScope(targeted=True, tmdb_ids=frozenset({tmdb_id})))
+        time.sleep(0.1)
+    assert runs.ran.wait(5)
+    [(ran_at, scope)] = runs.scopes
+    # Each submit restarts the delay: the run comes 0.2s after the last one, not the first.
+    assert ran_at - start >= 0.4
+    assert scope.tmdb_ids == {0, 1, 2}
+
+
+def test_debouncer_max_delay_bounds_a_steady_stream() -> None:
+    runs = _Runs()
+    debouncer = webhooks.Debouncer(runs, delay=0.2, max_delay=0.5)
+    start = time.monotonic()
+    while time.monotonic() - start < 1.2:
+        debouncer.submit(LinkScope(targeted=True, series_ids=frozenset({1})))
+        time.sleep(0.05)
+    assert runs.ran.wait(5)
+    first_at = runs.scopes[0][0]
+    assert 0.5 <= first_at - start < 0.9
+    assert len(runs.scopes) >= 2
+
+
+def test_untargeted_scope_wins_the_merge() -> None:
+    runs = _Runs()
+    debouncer = webhooks.Debouncer(runs, delay=0.05)
+    debouncer.submit(LinkScope(targeted=True, tmdb_ids=frozenset({1})))
+    debouncer.submit(LinkScope())
+    assert runs.ran.wait(5)
+    assert not runs.scopes[0][1].targeted
@@ -0,0 +1,195 @@
+"""Serve-mode inotify watcher on the directories of linked movie files, for near-instant relinks."""
+from __future__ import annotations
+
+import ctypes
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Optional
+
+import db
+import metrics
+from linker import LinkScope
+
+log = logging.getLogger(__name__)
+
+# <sys/inotify.h>
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+_WATCH_MASK = (
+    _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+)
+# struct inotify_event header: wd, mask, cookie, len; the NUL-padded name follows.
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+_WATCHED_DIRS = metrics.Gauge(
+    "plex_linker_watched_directories", "Movie directories watched for file changes (inotify)"
+)
+_WATCH_EVENTS = metrics.Counter(
+    "plex_linker_watch_events_total", "inotify events in watched movie directories that queued a relink"
+)
+
+
+class _Inotify:
+    """Thin ctypes wrapper over the Linux inotify syscalls."""
+
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._check(self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC))
+
+    @staticmethod
+    def _check(result: int, path: str = "") -> int:
+        if result < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), *([path] if path else []))
+        return result
+
+    def add(self, path: str) -> int:
+        return self._check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK), path)
+
+    def remove(self, wd: int) -> None:
+        # EINVAL: the kernel already dropped the watch (directory deleted).
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> list[tuple[int, int, str]]:
+        """Pending ``(wd, mask, name)`` events, waiting up to ``timeout`` seconds for the first."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, size = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + size].rstrip(b"\0"))
+            offset += size
+            events.append((wd, mask, name))
+        return events
+
+
+class MovieWatcher:
+    """Watch the directories holding the targets of managed links and relink their rules on change.
+
+    A Radarr upgrade deletes the old file and imports a new one with a different name, which
+    breaks the special's symlink. Creates, deletes and moves in a watched directory submit a
+    targeted scope for the rules linked from it; ``submit`` is expected to debounce. Call
+    ``refresh`` after each link run to follow the ``managed_links`` table.
+    """
+
+    def __init__(
+        self, db_url: str, submit: Callable[[LinkScope], Any], *, poll_seconds: float = 1.0
+    ) -> None:
+        self._db_url = db_url
+        self._submit = submit
+        self._poll = poll_seconds
+        self._inotify: Optional[_Inotify] = None
+        self._lock = threading.Lock()
+        self._wd_by_dir: dict[str, int] = {}
+        self._rules_by_wd: dict[int, frozenset[int]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        """Start watching; False when inotify is unavailable (not Linux, or no ``inotify_init1``)."""
+        if self._thread is not None:
+            return True
+        try:
+            self._inotify = _Inotify()
+        except (OSError, AttributeError):
+            log.warning("inotify is unavailable; movie directory watching disabled", exc_info=True)
+            return False
+        self.refresh()
+        self._thread = threading.Thread(target=self._loop, name="movie-watcher", daemon=True)
+        self._thread.start()
+        return True
+
+    def refresh(self) -> None:
+        """Watch exactly the directories of the current managed-link targets."""
+        inotify = self._inotify
+        if inotify is None:
+            return
+        rules_by_dir: dict[str, set[int]] = defaultdict(set)
+        for link in db.list_managed_links(self._db_url):
+            if link["rule_id"] is None:
+                continue
+            src = os.path.normpath(os.path.join(os.path.dirname(link["dst"]), link["target"]))
+            rules_by_dir[os.path.dirname(src)].add(link["rule_id"])
+
+        with self._lock:
+            for path in set(self._wd_by_dir) - set(rules_by_dir):
+                wd = self._wd_by_dir.pop(path)
+                self._rules_by_wd.pop(wd, None)
+                inotify.remove(wd)
+            for path, rule_ids in rules_by_dir.items():
+                wd = self._wd_by_dir.get(path)
+                if wd is None:
+                    try:
+                        wd = inotify.add(path)
+                    except OSError as exc:
+                        if exc.errno == errno.ENOSPC:
+                            log.warning("inotify watch limit reached (fs.inotify.max_user_watches)")
+                            break
+                        log.debug("Cannot watch %s: %s", path, exc)
+                        continue
+                    self._wd_by_dir[path] = wd
+                self._rules_by_wd[wd] = frozenset(rule_ids)
+            _WATCHED_DIRS.set(len(self._wd_by_dir))
+
+    def _forget(self, wd: int) -> None:
+        with self._lock:
+            self._rules_by_wd.pop(wd, None)
+            for path, watched in list(self._wd_by_dir.items()):
+                if watched == wd:
+                    del self._wd_by_dir[path]
+            _WATCHED_DIRS.set(len(self._wd_by_dir))
+
+    def _loop(self) -> None:
+        assert self._inotify is not None
+        while True:
+            try:
+                events = self._inotify.read(self._poll)
+            except OSError:
+                log.exception("Failed to read inotify events")
+                continue
+            rule_ids: set[int] = set()
+            overflow = False
+            for wd, mask, name in events:
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & _IN_IGNORED:
+                    # Follows IN_DELETE_SELF, which already queued the directory's rules.
+                    self._forget(wd)
+                    continue
+                if name.startswith("."):
+                    continue
+                with self._lock:
+                    rules = self._rules_by_wd.get(wd)
+                if rules:
+                    rule_ids |= rules
+                    _WATCH_EVENTS.inc()
+            if overflow:
+                # Events were lost, so any watched rule may be affected; let fingerprints sort it out.
+                log.warning("inotify queue overflowed; queueing an incremental run")
+                self._submit(LinkScope())
+            elif rule_ids:
+                log.info("Movie files changed; relinking %d rules", len(rule_ids))
+                self._submit(LinkScope(targeted=True, rule_ids=frozenset(rule_ids)))
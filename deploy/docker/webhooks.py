@@ -0,0 +1,104 @@
+"""Radarr/Sonarr webhook handling: turn *arr events into debounced, targeted link-job triggers."""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from linker import LinkScope
+
+log = logging.getLogger(__name__)
+
+# Events that can change where a movie file lives or whether a series' links are still valid.
+RADARR_EVENTS = frozenset({"Download", "Rename", "MovieFileDelete", "MovieDelete"})
+SONARR_EVENTS = frozenset({"Download", "Rename", "EpisodeFileDelete", "SeriesDelete"})
+
+
+def _payload_id(payload: dict[str, Any], section: str, key: str) -> Optional[int]:
+    """``payload[section][key]`` as a positive integer, or None when it is missing or malformed."""
+    value = payload.get(section)
+    raw = value.get(key) if isinstance(value, dict) else None
+    if raw is None:
+        return None
+    try:
+        number = int(raw)
+    except (TypeError, ValueError):
+        log.warning("Ignoring webhook with a malformed %s.%s: %r", section, key, raw)
+        return None
+    return number if number > 0 else None
+
+
+def radarr_scope(payload: dict[str, Any]) -> Optional[LinkScope]:
+    """Targeted scope for a Radarr webhook, or None when the event does not affect links."""
+    if payload.get("eventType") not in RADARR_EVENTS:
+        return None
+    tmdb_id = _payload_id(payload, "movie", "tmdbId")
+    if tmdb_id is None:
+        return None
+    return LinkScope(targeted=True, tmdb_ids=frozenset({tmdb_id}))
+
+
+def sonarr_scope(payload: dict[str, Any]) -> Optional[LinkScope]:
+    """Targeted scope for a Sonarr webhook, or None when the event does not affect links."""
+    if payload.get("eventType") not in SONARR_EVENTS:
+        return None
+    series_id = _payload_id(payload, "series", "id")
+    if series_id is None:
+        return None
+    return LinkScope(targeted=True, series_ids=frozenset({series_id}))
+
+
+class Debouncer:
+    """Merge scopes submitted in quick succession into a single run.
+
+    The merged scope is handed to ``run`` once no new scope has arrived for ``delay`` seconds, or
+    ``max_delay`` seconds after the first pending scope, whichever comes first.
+    """
+
+    def __init__(
+        self, run: Callable[[LinkScope], Any], *, delay: float, max_delay: Optional[float] = None
+    ) -> None:
+        self._run = run
+        self._delay = delay
+        self._max_delay = max_delay if max_delay is not None else delay * 6
+        self._pending: Optional[LinkScope] = None
+        self._first = 0.0
+        self._last = 0.0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, scope: LinkScope) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if self._pending is None:
+                self._pending = scope
+                self._first = now
+            else:
+                self._pending = self._pending.merge(scope)
+            self._last = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="webhook-debounce", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _take(self) -> LinkScope:
+        with self._cond:
+            while True:
+                if self._pending is None:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                due = min(self._last + self._delay, self._first + self._max_delay)
+                if now >= due:
+                    scope, self._pending = self._pending, None
+                    return scope
+                self._cond.wait(due - now)
+
+    def _loop(self) -> None:
+        while True:
+            scope = self._take()
+            try:
+                self._run(scope)
+            except Exception:
+                log.exception("Failed to queue targeted link job")